@@ -0,0 +1,535 @@
+# bench.py
+# Benchmarks del backend. Cada corrida usa su propia base temporal, así que
+# nunca toca pedidos.db.
+#
+# Uso (desde la carpeta backend):
+#   python bench.py sync --sizes 10 100 1000 --repeat 3
+#   python bench.py carga --clientes 1 8 32 --segundos 5
+#   python bench.py trafico --kioscos 6 --baristas 2 --pantallas 3 --historial 20000 --json r.json
+#   python bench.py comparar base.json r.json
+#   python bench.py vista --operaciones 4000 --hilos 4   (sale con 1 si hay diferencias)
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_TMP_DIR = tempfile.TemporaryDirectory(prefix="piko-bench-")
+os.environ.setdefault("PIKO_DB_FILE", str(Path(_TMP_DIR.name) / "bench.db"))
+# Un log por pedido ensuciaría la tabla (y el servidor de "carga" hereda esto)
+os.environ.setdefault("PIKO_LOG_LEVEL", "WARNING")
+
+import main  # noqa: E402  (necesita PIKO_DB_FILE ya configurado)
+
+
+def _pedido_aleatorio(rng: random.Random) -> main.PedidoOffline:
+    ids = list(main._catalogo.por_id)
+    return main.PedidoOffline(
+        productos=[rng.choice(ids) for _ in range(rng.randint(1, 5))],
+        total=0.0,
+        estado="pendiente",
+        modo="Para llevar - efectivo (OFFLINE)",
+        temp_id=f"tmp-{rng.getrandbits(64):x}",
+    )
+
+
+def _medir(preparar, fn, repeat: int) -> float:
+    # preparar() arma datos nuevos en cada vuelta (fuera del tiempo medido)
+    # para que las llaves de idempotencia nunca se repitan
+    tiempos = []
+    for _ in range(repeat):
+        datos = preparar()
+        inicio = time.perf_counter()
+        fn(datos)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def bench_sync(sizes, repeat: int) -> None:
+    """Compara insertar un lote offline pedido por pedido contra en una transacción."""
+    from fastapi.testclient import TestClient
+
+    rng = random.Random(1234)
+    print(f"DB: {main.DB_FILE}  synchronous={main.DB_SYNCHRONOUS}")
+    print(f"{'pedidos':>8} {'modo':<22} {'mediana (s)':>12} {'pedidos/s':>12}")
+    with TestClient(main.app) as client:
+        for n in sizes:
+            def preparar():
+                return [_pedido_aleatorio(rng) for _ in range(n)]
+
+            casos = {
+                "uno por uno": lambda lote: [main._insert_pedido(p) for p in lote],
+                "lote (1 transacción)": lambda lote: main._insert_pedidos(lote),
+                "POST /api/pedidos/sync": lambda lote: client.post(
+                    "/api/pedidos/sync",
+                    json={"pedidos": [p.model_dump() for p in lote]},
+                ).raise_for_status(),
+            }
+            for nombre, fn in casos.items():
+                segundos = _medir(preparar, fn, repeat)
+                print(f"{n:>8} {nombre:<22} {segundos:>12.4f} {n / segundos:>12.0f}")
+
+
+@contextlib.contextmanager
+def _servidor():
+    """Levanta uvicorn en otro proceso (misma base temporal) y regresa su URL.
+
+    Va en un proceso aparte para que los clientes del benchmark no compitan
+    por el GIL con el servidor que se está midiendo.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        puerto = sock.getsockname()[1]
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app",
+         "--host", "127.0.0.1", "--port", str(puerto), "--log-level", "warning"],
+        cwd=Path(__file__).resolve().parent,
+        env={**os.environ, "PIKO_DB_FILE": str(main.DB_FILE)},
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn no arrancó")
+            try:
+                socket.create_connection(("127.0.0.1", puerto), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{puerto}"
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+async def _carga(url: str, clientes: int, segundos: float, lecturas: int):
+    """Cada cliente crea un pedido y luego consulta el feed ``lecturas`` veces.
+
+    Aparte, una sonda pide /api/menu (que no toca la base) cada 10 ms: su
+    latencia muestra cuánto se queda bloqueado el event loop por la base.
+    """
+    import httpx
+
+    ids = list(main._catalogo.por_id)
+    latencias: List[float] = []
+    sonda: List[float] = []
+    fin = time.perf_counter() + segundos
+
+    async def cliente(n: int) -> None:
+        rng = random.Random(n)
+        # Como un cliente ya sincronizado: solo pide lo nuevo
+        revision = main._revision_actual()
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                r = await http.post("/api/pedidos", json={
+                    "productos": [rng.choice(ids) for _ in range(rng.randint(1, 5))],
+                    "modo": "Para llevar - efectivo",
+                })
+                r.raise_for_status()
+                latencias.append(time.perf_counter() - inicio)
+                for _ in range(lecturas):
+                    inicio = time.perf_counter()
+                    r = await http.get("/api/pedidos", params={"since": revision})
+                    r.raise_for_status()
+                    revision = r.json()["revision"]
+                    latencias.append(time.perf_counter() - inicio)
+
+    async def sondear() -> None:
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            while time.perf_counter() < fin:
+                inicio = time.perf_counter()
+                (await http.get("/api/menu")).raise_for_status()
+                sonda.append(time.perf_counter() - inicio)
+                await asyncio.sleep(0.01)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(sondear(), *(cliente(n) for n in range(clientes)))
+    return len(latencias), time.perf_counter() - inicio, latencias, sonda
+
+
+def _p95(valores: List[float]) -> float:
+    if len(valores) < 2:
+        return valores[0] if valores else 0.0
+    return statistics.quantiles(valores, n=20)[18]
+
+
+def bench_carga(clientes, segundos: float, lecturas: int) -> None:
+    """Throughput del servidor real con varios clientes concurrentes."""
+    print(f"DB: {main.DB_FILE}  pool={main.DB_POOL_SIZE}  lecturas por pedido={lecturas}")
+    print(
+        f"{'clientes':>8} {'requests':>9} {'req/s':>9} {'p50 (ms)':>9}"
+        f" {'p95 (ms)':>9} {'menu p95':>9}"
+    )
+    with _servidor() as url:
+        for n in clientes:
+            hechos, total, latencias, sonda = asyncio.run(_carga(url, n, segundos, lecturas))
+            print(
+                f"{n:>8} {hechos:>9} {hechos / total:>9.0f}"
+                f" {statistics.median(latencias) * 1000:>9.1f} {_p95(latencias) * 1000:>9.1f}"
+                f" {_p95(sonda) * 1000:>9.1f}"
+            )
+
+
+def _percentiles(valores: List[float]) -> Dict[str, float]:
+    if len(valores) < 2:
+        v = valores[0] if valores else 0.0
+        return {"p50": v, "p95": v, "p99": v}
+    cortes = statistics.quantiles(valores, n=100)
+    return {"p50": cortes[49], "p95": cortes[94], "p99": cortes[98]}
+
+
+def _sembrar_historial(n: int, rng: random.Random) -> None:
+    """Llena la base con ``n`` pedidos viejos (casi todos ya confirmados)."""
+    ids = list(main._catalogo.por_id)
+    estados = ["confirmado"] * 95 + ["listo"] * 2 + ["preparando"] * 2 + ["pendiente"]
+    for inicio in range(0, n, 1000):
+        main._insert_pedidos([
+            main.Pedido(
+                productos=[rng.choice(ids) for _ in range(rng.randint(1, 5))],
+                total=0.0,
+                estado=rng.choice(estados),
+                modo="Comer aquí - efectivo",
+            )
+            for _ in range(min(1000, n - inicio))
+        ])
+
+
+class _Registro:
+    """Latencias y errores por endpoint durante una corrida de tráfico."""
+
+    def __init__(self):
+        self.latencias: Dict[str, List[float]] = defaultdict(list)
+        self.errores: Dict[str, int] = defaultdict(int)
+
+    async def medir(self, endpoint: str, peticion):
+        inicio = time.perf_counter()
+        try:
+            r = await peticion
+        except Exception:
+            self.errores[endpoint] += 1
+            return None
+        self.latencias[endpoint].append(time.perf_counter() - inicio)
+        if r.status_code >= 400:
+            self.errores[endpoint] += 1
+        return r
+
+
+async def _trafico(url: str, args, registro: _Registro) -> float:
+    import httpx
+
+    ids = list(main._catalogo.por_id)
+    fin = time.perf_counter() + args.segundos
+
+    async def seguir_feed(http, estados, etiqueta: str, cuando_cambia=None):
+        # Igual que el frontend en modo polling: ?since= con If-None-Match
+        revision, etag, pedidos = 0, None, {}
+        while time.perf_counter() < fin:
+            headers = {"If-None-Match": etag} if etag else {}
+            r = await registro.medir(
+                f"GET /api/pedidos?since ({etiqueta})",
+                http.get("/api/pedidos", params={"since": revision, "estado": estados}, headers=headers),
+            )
+            if r is not None and r.status_code == 200:
+                etag = r.headers.get("etag")
+                data = r.json()
+                revision = data["revision"]
+                for p in data["pedidos"]:
+                    if p["estado"] in estados:
+                        pedidos[p["id"]] = p
+                    else:
+                        pedidos.pop(p["id"], None)
+            if cuando_cambia is not None:
+                await cuando_cambia(http, pedidos)
+            await asyncio.sleep(args.pausa_pantalla if cuando_cambia is None else args.pausa_barista)
+
+    async def kiosco(n: int) -> None:
+        rng = random.Random(args.seed * 1000 + n)
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            etag = None
+            while time.perf_counter() < fin:
+                headers = {"If-None-Match": etag} if etag else {}
+                r = await registro.medir("GET /api/menu", http.get("/api/menu", headers=headers))
+                if r is not None and r.status_code == 200:
+                    etag = r.headers.get("etag")
+                await registro.medir("POST /api/pedidos", http.post("/api/pedidos", json={
+                    "productos": [rng.choice(ids) for _ in range(rng.randint(1, 5))],
+                    "modo": rng.choice(["Comer aquí - efectivo", "Para llevar - tarjeta"]),
+                    "client_id": f"bench-{n}-{rng.getrandbits(48):x}",
+                }))
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * args.pausa_kiosco)
+
+    siguiente = {"pendiente": "preparando", "preparando": "listo", "listo": "confirmado"}
+
+    async def avanzar(http, pedidos) -> None:
+        # El barista mueve el pedido activo más viejo un paso adelante
+        if not pedidos:
+            return
+        pid = min(pedidos)
+        nuevo = siguiente[pedidos[pid]["estado"]]
+        r = await registro.medir(
+            "PUT /api/pedidos/{id}/estado",
+            http.put(f"/api/pedidos/{pid}/estado", json={"estado": nuevo}),
+        )
+        if r is not None and r.status_code == 200:
+            pedidos[pid]["estado"] = nuevo
+            if nuevo == "confirmado":
+                pedidos.pop(pid)
+
+    async def barista(n: int) -> None:
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            await seguir_feed(http, ["pendiente", "preparando", "listo"], "barista", avanzar)
+
+    async def pantalla(n: int) -> None:
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            await seguir_feed(http, ["preparando", "listo"], "pantalla")
+
+    inicio = time.perf_counter()
+    await asyncio.gather(
+        *(kiosco(n) for n in range(args.kioscos)),
+        *(barista(n) for n in range(args.baristas)),
+        *(pantalla(n) for n in range(args.pantallas)),
+    )
+    return time.perf_counter() - inicio
+
+
+def _commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_trafico(args) -> Dict[str, object]:
+    """Kioscos, baristas y pantallas a la vez contra uvicorn; reporta por endpoint."""
+    rng = random.Random(args.seed)
+    inicio = time.perf_counter()
+    _sembrar_historial(args.historial, rng)
+    print(f"DB: {main.DB_FILE}  historial={args.historial} ({time.perf_counter() - inicio:.1f} s)")
+    print(
+        f"kioscos={args.kioscos} baristas={args.baristas} pantallas={args.pantallas}"
+        f" segundos={args.segundos}"
+    )
+
+    registro = _Registro()
+    with _servidor() as url:
+        duracion = asyncio.run(_trafico(url, args, registro))
+
+    resultados: Dict[str, Dict[str, float]] = {}
+    print(f"{'endpoint':<38} {'n':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err':>5}")
+    for endpoint in sorted(set(registro.latencias) | set(registro.errores)):
+        lat = registro.latencias.get(endpoint, [])
+        pct = _percentiles(lat)
+        resultados[endpoint] = {
+            "n": len(lat),
+            "req_s": len(lat) / duracion,
+            "errores": registro.errores.get(endpoint, 0),
+            **{k: v * 1000 for k, v in pct.items()},
+        }
+        r = resultados[endpoint]
+        print(
+            f"{endpoint:<38} {r['n']:>7} {r['req_s']:>8.1f} {r['p50']:>8.1f}"
+            f" {r['p95']:>8.1f} {r['p99']:>8.1f} {r['errores']:>5}"
+        )
+    total = sum(r["n"] for r in resultados.values())
+    print(f"{'total':<38} {total:>7} {total / duracion:>8.1f}")
+
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "config": {
+            k: getattr(args, k)
+            for k in ("kioscos", "baristas", "pantallas", "historial", "segundos",
+                      "pausa_kiosco", "pausa_barista", "pausa_pantalla", "seed")
+        },
+        "duracion_s": duracion,
+        "total": {"n": total, "req_s": total / duracion},
+        "endpoints": resultados,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Resultado guardado en {args.json}")
+    return informe
+
+
+def comparar(base_path: str, nuevo_path: str) -> None:
+    """Diferencias de throughput y p95 entre dos resultados de ``trafico``."""
+    base = json.loads(Path(base_path).read_text(encoding="utf-8"))
+    nuevo = json.loads(Path(nuevo_path).read_text(encoding="utf-8"))
+    print(f"base: {base.get('commit')} ({base.get('fecha')})  nuevo: {nuevo.get('commit')} ({nuevo.get('fecha')})")
+    if base.get("config") != nuevo.get("config"):
+        print("¡Ojo! las dos corridas no usaron la misma configuración")
+    print(f"{'endpoint':<38} {'req/s':>16} {'p95 ms':>18} {'p99 ms':>18}")
+
+    def delta(a: float, b: float) -> str:
+        return f"{b:>8.1f} ({(b - a) / a * 100:+.0f}%)" if a else f"{b:>8.1f}"
+
+    for endpoint in sorted(set(base["endpoints"]) | set(nuevo["endpoints"])):
+        a = base["endpoints"].get(endpoint)
+        b = nuevo["endpoints"].get(endpoint)
+        if a is None or b is None:
+            print(f"{endpoint:<38} solo en {'nuevo' if a is None else 'base'}")
+            continue
+        print(
+            f"{endpoint:<38} {delta(a['req_s'], b['req_s']):>16}"
+            f" {delta(a['p95'], b['p95']):>18} {delta(a['p99'], b['p99']):>18}"
+        )
+
+
+def _cambios_sql(revision: int, estados: Optional[List[str]]):
+    actual, pedidos = main._get_pedidos_since(revision, estados)
+    return actual, [main._serializar_pedido(p) for p in pedidos]
+
+
+def bench_vista(args) -> int:
+    """Comprueba que la vista en memoria conteste igual que SQLite.
+
+    Varios hilos insertan, cambian estados y archivan al azar. Luego, para
+    cada cursor que la vista sabe contestar, se compara ``cambios_desde`` y
+    ``listar`` contra ``_get_pedidos_since`` y ``_get_all_pedidos``, y se
+    revisa que ningún client_id quede repetido entre activos y archivo.
+    Regresa cuántas respuestas no coincidieron.
+    """
+    # Pocos cerrados en memoria para que el piso suba y se pruebe el corte
+    main.VISTA_CERRADOS_MAX = args.cerrados_max
+    estados = ["pendiente", "preparando", "listo", "confirmado"]
+    productos_ids = list(main._catalogo.por_id)
+
+    def escribir(semilla: int) -> None:
+        rng = random.Random(semilla)
+        for _ in range(args.operaciones // args.hilos):
+            x = rng.random()
+            if x < 0.35 or main._vista.revision == 0:
+                main._insert_pedidos([
+                    main.Pedido(
+                        productos=[rng.choice(productos_ids) for _ in range(rng.randint(1, 4))],
+                        estado=rng.choice(estados),
+                        modo=rng.choice(["Comer aquí - tarjeta", "Para llevar - efectivo"]),
+                        # Llaves repetidas a propósito: también se prueban los reintentos
+                        client_id=f"c{rng.randrange(args.operaciones)}",
+                    )
+                    for _ in range(rng.randint(1, 5))
+                ])
+            elif x < 0.98:
+                main._update_estado(rng.randint(1, main._vista.revision), rng.choice(estados))
+            else:
+                main._archivar_confirmados(datetime.now() + timedelta(days=1), lote=50)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(args.hilos) as hilos:
+        list(hilos.map(escribir, range(args.seed, args.seed + args.hilos)))
+    vista = main._vista
+    print(
+        f"DB: {main.DB_FILE}  operaciones={args.operaciones} hilos={args.hilos}"
+        f" ({time.perf_counter() - inicio:.1f} s)"
+    )
+    print(f"revision={vista.revision} piso={vista.piso} en memoria={len(vista._pedidos)}")
+
+    revisadas = diferencias = 0
+
+    def revisar(nombre: str, memoria, sql) -> None:
+        nonlocal revisadas, diferencias
+        revisadas += 1
+        if memoria != sql:
+            diferencias += 1
+            if diferencias <= 10:
+                print(f"diferencia: {nombre}")
+
+    filtros = [None, ["pendiente", "preparando", "listo"], ["preparando", "listo"], ["confirmado"]]
+    for revision in [0, *range(vista.piso, vista.revision + 2)]:
+        for filtro in filtros:
+            memoria = vista.cambios_desde(revision, filtro)
+            if memoria is not None:
+                revisar(f"since={revision} estados={filtro}", memoria, _cambios_sql(revision, filtro))
+    for filtro in filtros[1:3]:
+        for limite in (None, 10):
+            revisar(
+                f"listar estados={filtro} limit={limite}",
+                vista.listar(filtro, limite),
+                [main._serializar_pedido(p) for p in main._get_all_pedidos(estados=filtro, limit=limite)],
+            )
+    # Un reintento de un pedido ya archivado no debe haber creado otro
+    with main._get_conn() as conn:
+        repetidas = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT client_id FROM (
+                    SELECT client_id FROM pedidos UNION ALL SELECT client_id FROM pedidos_archivo
+                )
+                WHERE client_id IS NOT NULL GROUP BY client_id HAVING COUNT(*) > 1
+                """
+            )
+        ]
+    revisar(f"client_id repetidos entre pedidos y archivo: {repetidas[:5]}", repetidas, [])
+    print(f"consultas comparadas={revisadas} diferencias={diferencias}")
+    return diferencias
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks del backend de Piko")
+    sub = parser.add_subparsers(dest="escenario", required=True)
+
+    p_sync = sub.add_parser("sync", help="Carga de lotes offline en /api/pedidos/sync")
+    p_sync.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    p_sync.add_argument("--repeat", type=int, default=3)
+
+    p_carga = sub.add_parser("carga", help="Clientes concurrentes contra uvicorn (pedidos + feed)")
+    p_carga.add_argument("--clientes", type=int, nargs="+", default=[1, 8, 32])
+    p_carga.add_argument("--segundos", type=float, default=5)
+    p_carga.add_argument("--lecturas", type=int, default=4)
+
+    p_trafico = sub.add_parser("trafico", help="Kioscos, baristas y pantallas simulados a la vez")
+    p_trafico.add_argument("--kioscos", type=int, default=6)
+    p_trafico.add_argument("--baristas", type=int, default=2)
+    p_trafico.add_argument("--pantallas", type=int, default=3)
+    p_trafico.add_argument("--historial", type=int, default=10000, help="pedidos viejos en la base")
+    p_trafico.add_argument("--segundos", type=float, default=15)
+    p_trafico.add_argument("--pausa-kiosco", type=float, default=0.5, help="segundos entre pedidos (promedio)")
+    p_trafico.add_argument("--pausa-barista", type=float, default=0.2)
+    p_trafico.add_argument("--pausa-pantalla", type=float, default=1.0)
+    p_trafico.add_argument("--seed", type=int, default=1234)
+    p_trafico.add_argument("--json", help="archivo donde guardar el resultado")
+
+    p_comparar = sub.add_parser("comparar", help="Compara dos resultados JSON de 'trafico'")
+    p_comparar.add_argument("base")
+    p_comparar.add_argument("nuevo")
+
+    p_vista = sub.add_parser("vista", help="Compara la vista en memoria contra SQLite")
+    p_vista.add_argument("--operaciones", type=int, default=4000)
+    p_vista.add_argument("--hilos", type=int, default=4)
+    p_vista.add_argument("--cerrados-max", type=int, default=50, help="confirmados que guarda la vista")
+    p_vista.add_argument("--seed", type=int, default=1234)
+
+    args = parser.parse_args()
+    if args.escenario == "sync":
+        bench_sync(args.sizes, args.repeat)
+    elif args.escenario == "carga":
+        bench_carga(args.clientes, args.segundos, args.lecturas)
+    elif args.escenario == "trafico":
+        bench_trafico(args)
+    elif args.escenario == "comparar":
+        comparar(args.base, args.nuevo)
+    elif args.escenario == "vista":
+        sys.exit(1 if bench_vista(args) else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
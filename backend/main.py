@@ -1,15 +1,280 @@
 # backend.py
+import asyncio
+import atexit
+import bisect
+import contextvars
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
 import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
 import sqlite3
-from datetime import datetime
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware  # <--- IMPORTANTE
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 
-app = FastAPI()
+try:
+    import brotli  # opcional: si está instalado también servimos el menú en br
+except ImportError:
+    brotli = None
+
+# --- Logging ---
+# Los logs se encolan y un hilo aparte los escribe: el event loop nunca se
+# queda esperando a stdout. Salida en JSON (una línea por evento) o texto.
+LOG_LEVEL = os.getenv("PIKO_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("PIKO_LOG_FORMAT", "json").lower()
+# Fracción de requests normales que se registran; errores y lentos siempre
+LOG_MUESTREO = float(os.getenv("PIKO_LOG_MUESTREO", "0.1"))
+LOG_LENTO_MS = float(os.getenv("PIKO_LOG_LENTO_MS", "500"))
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "piko_request_id", default=None
+)
+
+class _ColaLogHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Se guarda el request id aquí porque el contextvar no existe en el hilo
+        # que escribe; el formateo (json.dumps) queda para ese hilo
+        record.request_id = _request_id.get()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class _FormatoJson(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        evento: Dict[str, object] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.msg,
+        }
+        if getattr(record, "request_id", None):
+            evento["request_id"] = record.request_id
+        evento.update(getattr(record, "campos", None) or {})
+        if record.exc_text:
+            evento["error"] = record.exc_text
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+class _FormatoTexto(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        campos = " ".join(f"{k}={v}" for k, v in (getattr(record, "campos", None) or {}).items())
+        rid = getattr(record, "request_id", None)
+        linea = f"{self.formatTime(record)} {record.levelname:<7} {record.msg}"
+        linea += f" [{rid}]" if rid else ""
+        linea += f" {campos}" if campos else ""
+        return linea + (f"\n{record.exc_text}" if record.exc_text else "")
+
+def _configurar_logging() -> logging.handlers.QueueListener:
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(_FormatoJson() if LOG_FORMAT == "json" else _FormatoTexto())
+    cola: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger = logging.getLogger("piko")
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers[:] = [_ColaLogHandler(cola)]
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(cola, salida)
+    listener.start()
+    # stop() escribe lo que quede en la cola antes de salir
+    atexit.register(listener.stop)
+    return listener
+
+_log_listener = _configurar_logging()
+log = logging.getLogger("piko")
+
+def _muestrear(tasa: float) -> bool:
+    return tasa >= 1 or random.random() < tasa
+
+# --- Métricas (formato Prometheus en /metrics) ---
+# Registrar es sumar a unos contadores en memoria; el texto solo se arma
+# cuando alguien consulta /metrics.
+METRICAS_ACTIVAS = os.getenv("PIKO_METRICAS", "1") == "1"
+METRICAS_LAG_SEGUNDOS = float(os.getenv("PIKO_METRICAS_LAG_SEGUNDOS", "0.5"))
+
+_BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_BUCKETS_BYTES = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+class _Histograma:
+    """Histograma con etiquetas; seguro entre hilos (la base mide desde su pool)."""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valores: Tuple[str, ...], valor: float) -> None:
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                # [conteo por bucket..., +Inf, suma]
+                serie = self._series[valores] = [0.0] * (len(self.buckets) + 2)
+            serie[i] += 1
+            serie[-1] += valor
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, serie in sorted(series.items()):
+            base = ",".join(f'{k}="{_escapar_etiqueta(v)}"' for k, v in zip(self.etiquetas, valores))
+            acumulado = 0.0
+            for limite, conteo in zip((*self.buckets, "+Inf"), serie[:-1]):
+                acumulado += conteo
+                le = f'le="{limite}"'
+                lineas.append(f"{self.nombre}_bucket{{{base + ',' if base else ''}{le}}} {acumulado:g}")
+            etiquetas = f"{{{base}}}" if base else ""
+            lineas.append(f"{self.nombre}_sum{etiquetas} {serie[-1]:.6f}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {acumulado:g}")
+        return lineas
+
+def _escapar_etiqueta(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_m_request_segundos = _Histograma(
+    "piko_http_request_duration_seconds", "Duración de cada request por ruta.",
+    ("metodo", "ruta", "status"), _BUCKETS_SEGUNDOS,
+)
+_m_request_bytes = _Histograma(
+    "piko_http_request_size_bytes", "Tamaño del cuerpo recibido (Content-Length).",
+    ("metodo", "ruta"), _BUCKETS_BYTES,
+)
+_m_response_bytes = _Histograma(
+    "piko_http_response_size_bytes", "Bytes de cuerpo enviados por respuesta.",
+    ("metodo", "ruta"), _BUCKETS_BYTES,
+)
+_m_db_segundos = _Histograma(
+    "piko_db_helper_duration_seconds", "Tiempo de cada helper de SQLite (incluye esperar el candado).",
+    ("helper",), _BUCKETS_SEGUNDOS,
+)
+_m_loop_lag = _Histograma(
+    "piko_event_loop_lag_seconds", "Retraso del event loop al despertar de un sleep.",
+    (), _BUCKETS_SEGUNDOS,
+)
+_METRICAS = (_m_request_segundos, _m_request_bytes, _m_response_bytes, _m_db_segundos, _m_loop_lag)
+
+def _medido(fn):
+    """Decorador: registra la duración del helper de la base en las métricas."""
+    if not METRICAS_ACTIVAS:
+        return fn
+    etiqueta = (fn.__name__,)
+
+    @functools.wraps(fn)
+    def envuelto(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _m_db_segundos.observar(etiqueta, time.perf_counter() - inicio)
+    return envuelto
+
+async def _vigilar_event_loop() -> None:
+    # Si el loop está ocupado, el sleep despierta tarde: esa diferencia es el lag
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(METRICAS_LAG_SEGUNDOS)
+        _m_loop_lag.observar((), max(0.0, time.perf_counter() - inicio - METRICAS_LAG_SEGUNDOS))
+
+class _RequestMiddleware:
+    """Asigna un request id (o respeta X-Request-ID), registra cada request en
+    el log y mide su duración y tamaños para /metrics.
+
+    Es ASGI puro para no envolver la respuesta: el stream SSE sigue fluyendo.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:12]
+        token = _request_id.set(rid)
+        inicio = time.perf_counter()
+        estado = 500
+        enviados = 0
+
+        async def enviar(mensaje):
+            nonlocal estado, enviados
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+                mensaje["headers"] = [*mensaje.get("headers", []), (b"x-request-id", rid.encode("latin-1"))]
+            elif mensaje["type"] == "http.response.body":
+                enviados += len(mensaje.get("body", b""))
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            segundos = time.perf_counter() - inicio
+            ms = segundos * 1000
+            if METRICAS_ACTIVAS:
+                # La plantilla de la ruta (/api/pedidos/{pedido_id}), no el path,
+                # para no crear una serie por cada id
+                ruta = getattr(scope.get("route"), "path", None) or "sin_ruta"
+                metodo = scope["method"]
+                _m_request_segundos.observar((metodo, ruta, str(estado)), segundos)
+                _m_response_bytes.observar((metodo, ruta), enviados)
+                largo = headers.get(b"content-length")
+                if largo and largo.isdigit():
+                    _m_request_bytes.observar((metodo, ruta), int(largo))
+            if estado >= 400 or ms >= LOG_LENTO_MS or _muestrear(LOG_MUESTREO):
+                log.log(
+                    logging.WARNING if estado >= 500 else logging.INFO,
+                    "request",
+                    extra={"campos": {
+                        "metodo": scope["method"],
+                        "ruta": scope["path"],
+                        "status": estado,
+                        "ms": round(ms, 2),
+                    }},
+                )
+            _request_id.reset(token)
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    _hub.apagando = False
+    vigia = asyncio.create_task(_vigilar_event_loop()) if METRICAS_ACTIVAS else None
+    archivero = asyncio.create_task(_archivar_periodicamente()) if ARCHIVO_ACTIVO else None
+    yield
+    for tarea in (vigia, archivero):
+        if tarea is not None:
+            tarea.cancel()
+    # Al apagar el servidor escribimos lo que quedó en la cola de ingesta,
+    # cortamos los streams abiertos y cerramos las conexiones del pool
+    await _ingesta.cerrar()
+    _hub.close()
+    _cerrar_db_hilos()
+    _pool.close()
+
+app = FastAPI(lifespan=_lifespan)
 
 # --- 1. CONFIGURACIÓN CORS (OBLIGATORIO PARA PWA) ---
 # Esto permite que tu Flet (puerto 8080) hable con FastAPI (puerto 9000)
@@ -17,15 +282,19 @@ origins = [
     "*"  # En producción, cambia esto por la URL de tu dominio
 ]
 
+app.add_middleware(_RequestMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],  # Permite POST, GET, PUT, DELETE
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Request-ID"],
 )
 
-# Base de datos simulada (Menú)
+# Menú inicial: solo se usa para sembrar las tablas del catálogo la primera
+# vez. Después el menú vive en la base y se edita con /api/admin/productos.
 productos = [
     {"id": 1, "nombre": "Chilaquiles verdes", "precio": 95.0, "seccion": "Desayunos", "descripcion": "Totopos bañados en salsa verde con pollo deshebrado, crema y queso fresco."},
     {"id": 2, "nombre": "Molletes con pico de gallo", "precio": 72.0, "seccion": "Desayunos", "descripcion": "Pan bolillo con frijoles refritos, queso gratinado y pico de gallo fresco."},
@@ -44,31 +313,581 @@ productos = [
     {"id": 15, "nombre": "Latte de vainilla", "precio": 38.0, "seccion": "Bebidas", "descripcion": "Doble espresso con leche cremosa y jarabe de vainilla."},
 ]
 
-DB_FILE = Path(__file__).resolve().parent / "pedidos.db"
+# --- Catálogo indexado ---
+class _Catalogo:
+    """Foto inmutable del menú con índices por id.
 
-def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(DB_FILE), check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    Se construye una vez al arrancar (y en cada recarga del menú) para que
+    las búsquedas por id sean O(1) en lugar de recorrer la lista completa.
+    """
 
-def _init_db():
-    DB_FILE.parent.mkdir(parents=True, exist_ok=True)
+    __slots__ = (
+        "version", "etag", "ordenados", "por_id", "nombres", "nombres_huella", "precios",
+        "menu_cuerpos", "menu_etags",
+    )
+
+    def __init__(self, items: Iterable[Dict[str, object]], version: int):
+        copias = [dict(p) for p in items]
+        self.version = version
+        # El menú solo muestra lo disponible (y sin ese campo, como siempre);
+        # los índices conservan todo para nombrar pedidos viejos
+        visibles = [
+            {k: v for k, v in p.items() if k != "disponible"}
+            for p in copias
+            if p.get("disponible", True)
+        ]
+        # Mismo orden que siempre ha devuelto /api/menu
+        self.ordenados: Tuple[Dict[str, object], ...] = tuple(
+            sorted(visibles, key=lambda p: (p.get("seccion", ""), p.get("nombre", "")))
+        )
+        self.por_id: Mapping[int, Dict[str, object]] = MappingProxyType(
+            {int(p["id"]): p for p in copias}
+        )
+        self.nombres: Mapping[int, str] = MappingProxyType(
+            {pid: str(p.get("nombre", "")) for pid, p in self.por_id.items()}
+        )
+        self.precios: Mapping[int, float] = MappingProxyType(
+            {pid: float(p.get("precio", 0) or 0) for pid, p in self.por_id.items()}
+        )
+        # Huella de los nombres de todos los productos, disponibles o no: es
+        # lo único del catálogo que aparece en las respuestas de pedidos
+        self.nombres_huella = hashlib.sha1(
+            repr(sorted(self.nombres.items())).encode("utf-8")
+        ).hexdigest()[:16]
+
+        # Respuesta de /api/menu ya codificada (mismo formato que JSONResponse)
+        # y comprimida; solo se vuelve a armar cuando se recarga el catálogo
+        cuerpo = json.dumps(
+            list(self.ordenados),
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        cuerpos = {"identity": cuerpo, "gzip": gzip.compress(cuerpo, 9, mtime=0)}
+        if brotli is not None:
+            cuerpos["br"] = brotli.compress(cuerpo, quality=9)
+        self.menu_cuerpos: Mapping[str, bytes] = MappingProxyType(cuerpos)
+
+        # Huella del contenido: no cambia entre reinicios si el menú es el mismo.
+        # Cada codificación lleva su propia etiqueta (ETag fuerte por representación)
+        huella = hashlib.sha1(cuerpo).hexdigest()[:16]
+        self.etag = f'"menu-{huella}"'
+        self.menu_etags: Mapping[str, str] = MappingProxyType({
+            enc: self.etag if enc == "identity" else f'"menu-{huella}-{enc}"'
+            for enc in cuerpos
+        })
+
+_catalogo = _Catalogo((), version=0)
+_catalogo_lock = threading.Lock()
+
+def _recargar_catalogo(
+    items: Iterable[Dict[str, object]], version: Optional[int] = None
+) -> _Catalogo:
+    """Reconstruye los índices y los publica de un solo golpe.
+
+    Las recargas corren en hilos del pool y pueden terminar en desorden: una
+    foto con versión menor a la publicada se descarta para no regresar a un
+    catálogo viejo.
+    """
+    global _catalogo
+    with _catalogo_lock:
+        nuevo = _Catalogo(items, version=_catalogo.version + 1 if version is None else version)
+        if nuevo.version < _catalogo.version:
+            return _catalogo
+        _catalogo = nuevo
+        return nuevo
+
+# Índice provisional con el menú inicial mientras se migra la base; al terminar
+# _init_db se reemplaza por lo que hay en las tablas del catálogo (que empiezan
+# en la versión 0, por eso el provisional no puede pasar de ahí)
+_recargar_catalogo(productos, version=0)
+
+DB_FILE = Path(os.getenv("PIKO_DB_FILE") or Path(__file__).resolve().parent / "pedidos.db")
+
+# --- Ajustes de SQLite (se pueden sobreescribir con variables de entorno) ---
+DB_POOL_SIZE = int(os.getenv("PIKO_DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT = float(os.getenv("PIKO_DB_BUSY_TIMEOUT", "5"))  # segundos
+# FULL: cada commit hace fsync del WAL, así un pedido confirmado sobrevive a
+# un corte de luz. El group commit de la ingesta reparte ese fsync entre
+# todos los pedidos del grupo. NORMAL es más rápido pero puede perder los
+# últimos commits si se va la luz.
+DB_SYNCHRONOUS = os.getenv("PIKO_DB_SYNCHRONOUS", "FULL").upper()
+DB_CACHE_KB = int(os.getenv("PIKO_DB_CACHE_KB", "8192"))
+DB_MMAP_BYTES = int(os.getenv("PIKO_DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+
+class _ConnectionPool:
+    """Pool de conexiones SQLite reutilizables.
+
+    Un hilo conserva la conexión que tomó mientras la usa (las llamadas
+    anidadas reciben la misma) y al terminar la devuelve para que otro hilo
+    la aproveche. Nunca hay más de ``size`` conexiones abiertas a la vez.
+    """
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[sqlite3.Connection] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            str(self.path), timeout=DB_BUSY_TIMEOUT, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL ya quedó activado en el archivo por _init_db; estos pragmas son por conexión
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_BYTES}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._all = self._all, []
+        self._idle = queue.LifoQueue()
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+_pool = _ConnectionPool(DB_FILE, DB_POOL_SIZE)
+
+@contextmanager
+def _get_conn() -> Iterator[sqlite3.Connection]:
+    # Toma una conexión del pool y hace commit (o rollback si hubo error) al salir
+    with _pool.connection() as conn:
+        with conn:
+            yield conn
+
+# Los helpers de la base son síncronos; los endpoints los corren en estos
+# hilos para no frenar el event loop. Un hilo por conexión del pool, así
+# cada hilo conserva la suya y nunca se queda esperando un lugar.
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+def _db_hilos() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=_pool.size, thread_name_prefix="piko-db")
+    return _db_executor
+
+def _cerrar_db_hilos() -> None:
+    global _db_executor
+    executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+async def _db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Corre un helper de la base en el pool de hilos y espera su resultado."""
+    loop = asyncio.get_running_loop()
+    # run_in_executor no copia el contexto: lo pasamos para conservar el request id
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _db_hilos(), contexto.run, functools.partial(fn, *args, **kwargs)
+    )
+
+def _agrupar_items(productos_ids: Iterable[int]) -> List[Tuple[int, int, int]]:
+    """Convierte la lista de ids del pedido en renglones (posicion, producto_id, cantidad).
+
+    Las repeticiones se juntan en un solo renglón respetando el orden en que
+    apareció cada producto por primera vez.
+    """
+    cantidades: Dict[int, int] = {}
+    for pid in productos_ids:
+        cantidades[pid] = cantidades.get(pid, 0) + 1
+    return [(pos, pid, cant) for pos, (pid, cant) in enumerate(cantidades.items())]
+
+# --- Catálogo en la base ---
+def _upsert_productos(conn: sqlite3.Connection, items: Iterable[Dict[str, object]]) -> int:
+    """Inserta o actualiza productos (y sus secciones) y sube la versión del catálogo."""
+    items = list(items)
+    conn.executemany(
+        "INSERT OR IGNORE INTO catalogo_secciones (nombre) VALUES (?)",
+        [(str(p["seccion"]),) for p in items],
+    )
+    secciones = {
+        r["nombre"]: r["id"]
+        for r in conn.execute("SELECT id, nombre FROM catalogo_secciones")
+    }
+    conn.executemany(
+        """
+        INSERT INTO catalogo_productos (id, nombre, precio, seccion_id, descripcion, disponible)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            nombre = excluded.nombre,
+            precio = excluded.precio,
+            seccion_id = excluded.seccion_id,
+            descripcion = excluded.descripcion,
+            disponible = excluded.disponible
+        """,
+        [
+            (
+                int(p["id"]),
+                str(p["nombre"]),
+                float(p["precio"]),
+                secciones[str(p["seccion"])],
+                str(p.get("descripcion") or ""),
+                1 if p.get("disponible", True) else 0,
+            )
+            for p in items
+        ],
+    )
+    conn.execute("UPDATE catalogo_meta SET version = version + 1")
+    return len(items)
+
+@_medido
+def _guardar_productos(items: List[Dict[str, object]]) -> int:
     with _get_conn() as conn:
-        conn.execute(
+        conn.execute("BEGIN IMMEDIATE")
+        return _upsert_productos(conn, items)
+
+@_medido
+def _cargar_catalogo() -> _Catalogo:
+    """Lee el catálogo de la base y lo publica como el índice activo."""
+    with _get_conn() as conn:
+        # Versión y productos de la misma foto de la base
+        conn.execute("BEGIN")
+        version = conn.execute("SELECT version FROM catalogo_meta").fetchone()[0]
+        rows = conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS pedidos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                productos TEXT NOT NULL,
-                total REAL NOT NULL,
-                estado TEXT NOT NULL,
-                modo TEXT,
-                created_at TEXT
-            )
+            SELECT p.id, p.nombre, p.precio, s.nombre AS seccion, p.descripcion, p.disponible
+            FROM catalogo_productos p
+            JOIN catalogo_secciones s ON s.id = p.seccion_id
+            ORDER BY p.id
             """
+        ).fetchall()
+    items = [
+        {
+            "id": r["id"],
+            "nombre": r["nombre"],
+            "precio": r["precio"],
+            "seccion": r["seccion"],
+            "descripcion": r["descripcion"],
+            "disponible": bool(r["disponible"]),
+        }
+        for r in rows
+    ]
+    return _recargar_catalogo(items, version=int(version))
+
+# --- Acumulados de ventas ---
+# ventas_hora y ventas_productos_hora guardan totales por hora ("YYYY-MM-DDTHH")
+# que se suman en la misma transacción que inserta cada pedido; los reportes
+# leen de aquí y nunca recorren pedidos ni el archivo.
+SIN_ESPECIFICAR = "sin especificar"
+
+def _desglosar_modo(modo: Optional[str]) -> Tuple[str, str]:
+    """Separa ``modo`` ("Comer aquí - tarjeta (OFFLINE)") en consumo y forma de pago."""
+    texto = (modo or "").replace("(OFFLINE)", "").strip()
+    consumo, separador, pago = texto.rpartition(" - ")
+    if not separador:
+        consumo, pago = texto, ""
+    return consumo.strip() or SIN_ESPECIFICAR, pago.strip().lower() or SIN_ESPECIFICAR
+
+def _sumar_ventas(
+    conn: sqlite3.Connection,
+    pedidos: Iterable[Tuple[Optional[str], Optional[str], float, Iterable[Tuple[int, int, float]]]],
+) -> None:
+    """Suma pedidos (created_at, modo, total, renglones) a los acumulados por hora.
+
+    Cada renglón es (producto_id, cantidad, precio_unitario). Se agrupa en
+    memoria primero para que un lote grande sean pocos upserts.
+    """
+    por_hora: Dict[Tuple[str, str, str], List[float]] = {}
+    por_producto: Dict[Tuple[str, int, str, str], List[float]] = {}
+    for created_at, modo, total, renglones in pedidos:
+        hora = (created_at or "")[:13]
+        consumo, pago = _desglosar_modo(modo)
+        acumulado = por_hora.setdefault((hora, consumo, pago), [0, 0.0])
+        acumulado[0] += 1
+        acumulado[1] += total
+        for pid, cantidad, precio in renglones:
+            acumulado = por_producto.setdefault((hora, pid, consumo, pago), [0, 0.0])
+            acumulado[0] += cantidad
+            acumulado[1] += cantidad * precio
+    conn.executemany(
+        """
+        INSERT INTO ventas_hora (hora, consumo, pago, pedidos, importe)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (hora, consumo, pago) DO UPDATE SET
+            pedidos = pedidos + excluded.pedidos,
+            importe = importe + excluded.importe
+        """,
+        [(*llave, *valores) for llave, valores in por_hora.items()],
+    )
+    conn.executemany(
+        """
+        INSERT INTO ventas_productos_hora (hora, producto_id, consumo, pago, cantidad, importe)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (hora, producto_id, consumo, pago) DO UPDATE SET
+            cantidad = cantidad + excluded.cantidad,
+            importe = importe + excluded.importe
+        """,
+        [(*llave, *valores) for llave, valores in por_producto.items()],
+    )
+
+# --- Migraciones de esquema ---
+# Cada función lleva la base de la versión N-1 a la N (PRAGMA user_version).
+# Nunca se editan las ya publicadas: los cambios nuevos van en una migración nueva.
+
+def _migracion_pedidos(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            productos TEXT NOT NULL,
+            total REAL NOT NULL,
+            estado TEXT NOT NULL,
+            modo TEXT,
+            created_at TEXT
         )
-        conn.commit()
+        """
+    )
+
+def _migracion_revision(conn: sqlite3.Connection) -> None:
+    # Bases anteriores al versionado pudieron haber recibido ya la columna
+    columnas = {r["name"] for r in conn.execute("PRAGMA table_info(pedidos)")}
+    if "revision" not in columnas:
+        conn.execute("ALTER TABLE pedidos ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE pedidos SET revision = id")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_revision ON pedidos (revision)")
+
+def _migracion_items(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedido_items (
+            pedido_id INTEGER NOT NULL REFERENCES pedidos (id),
+            posicion INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            precio_unitario REAL NOT NULL,
+            PRIMARY KEY (pedido_id, posicion)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedido_items_producto ON pedido_items (producto_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_estado_id ON pedidos (estado, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_created_at ON pedidos (created_at)")
+
+    # Pasamos los pedidos existentes a renglones. El precio histórico no se
+    # guardaba, así que se toma el del catálogo actual.
+    precios = _catalogo.precios
+    items = []
+    for row in conn.execute("SELECT id, productos FROM pedidos"):
+        try:
+            productos_ids = json.loads(row["productos"])
+        except Exception:
+            productos_ids = []
+        items.extend(
+            (row["id"], pos, pid, cant, precios.get(pid, 0.0))
+            for pos, pid, cant in _agrupar_items(productos_ids)
+        )
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO pedido_items
+            (pedido_id, posicion, producto_id, cantidad, precio_unitario)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        items,
+    )
+
+def _migracion_client_id(conn: sqlite3.Connection) -> None:
+    # Llave de idempotencia generada por el cliente (un UUID por pedido)
+    conn.execute("ALTER TABLE pedidos ADD COLUMN client_id TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_pedidos_client_id ON pedidos (client_id)")
+
+def _migracion_catalogo(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS catalogo_secciones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS catalogo_productos (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            precio REAL NOT NULL,
+            seccion_id INTEGER NOT NULL REFERENCES catalogo_secciones (id),
+            descripcion TEXT NOT NULL DEFAULT '',
+            disponible INTEGER NOT NULL DEFAULT 1
+        )
+        """
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS catalogo_meta (version INTEGER NOT NULL)"
+    )
+    if conn.execute("SELECT COUNT(*) FROM catalogo_meta").fetchone()[0] == 0:
+        conn.execute("INSERT INTO catalogo_meta (version) VALUES (0)")
+    if conn.execute("SELECT COUNT(*) FROM catalogo_productos").fetchone()[0] == 0:
+        _upsert_productos(conn, productos)
+
+def _migracion_archivo(conn: sqlite3.Connection) -> None:
+    # Mismas columnas que pedidos/pedido_items; aquí van los confirmados viejos
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedidos_archivo (
+            id INTEGER PRIMARY KEY,
+            productos TEXT NOT NULL,
+            total REAL NOT NULL,
+            estado TEXT NOT NULL,
+            modo TEXT,
+            created_at TEXT NOT NULL,
+            revision INTEGER NOT NULL DEFAULT 0,
+            client_id TEXT,
+            archivado_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedido_items_archivo (
+            pedido_id INTEGER NOT NULL REFERENCES pedidos_archivo (id),
+            posicion INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            precio_unitario REAL NOT NULL,
+            PRIMARY KEY (pedido_id, posicion)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_archivo_created_at ON pedidos_archivo (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_archivo_revision ON pedidos_archivo (revision)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedido_items_archivo_producto ON pedido_items_archivo (producto_id)")
+
+def _migracion_ventas(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ventas_hora (
+            hora TEXT NOT NULL,
+            consumo TEXT NOT NULL,
+            pago TEXT NOT NULL,
+            pedidos INTEGER NOT NULL,
+            importe REAL NOT NULL,
+            PRIMARY KEY (hora, consumo, pago)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ventas_productos_hora (
+            hora TEXT NOT NULL,
+            producto_id INTEGER NOT NULL,
+            consumo TEXT NOT NULL,
+            pago TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            importe REAL NOT NULL,
+            PRIMARY KEY (hora, producto_id, consumo, pago)
+        ) WITHOUT ROWID
+        """
+    )
+    # Acumulamos la historia que ya existe, activa y archivada
+    for tabla, tabla_items in (("pedidos", "pedido_items"), ("pedidos_archivo", "pedido_items_archivo")):
+        renglones: Dict[int, List[Tuple[int, int, float]]] = {}
+        for r in conn.execute(
+            f"SELECT pedido_id, producto_id, cantidad, precio_unitario FROM {tabla_items}"
+        ):
+            renglones.setdefault(r[0], []).append((r[1], r[2], r[3]))
+        _sumar_ventas(conn, (
+            (r["created_at"], r["modo"], float(r["total"] or 0), renglones.get(r["id"], ()))
+            for r in conn.execute(f"SELECT id, created_at, modo, total FROM {tabla}")
+        ))
+
+def _migracion_estados(conn: sqlite3.Connection) -> None:
+    # Bitácora de cambios de estado. No tiene llave foránea a pedidos porque
+    # se conserva cuando el pedido pasa al archivo. Los pedidos viejos no
+    # traen historia: solo se sabe cuándo se crearon, no cuándo se prepararon.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pedido_estados (
+            id INTEGER PRIMARY KEY,
+            pedido_id INTEGER NOT NULL,
+            estado TEXT NOT NULL,
+            momento TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedido_estados_pedido ON pedido_estados (pedido_id, estado, momento)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedido_estados_estado ON pedido_estados (estado)")
+
+def _migracion_archivo_client_id(conn: sqlite3.Connection) -> None:
+    # La idempotencia también busca en el archivo. No es UNIQUE: un archivo
+    # viejo puede traer repetidos de antes de que se buscara ahí.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_archivo_client_id ON pedidos_archivo (client_id)")
+
+_MIGRACIONES = [
+    _migracion_pedidos,
+    _migracion_revision,
+    _migracion_items,
+    _migracion_client_id,
+    _migracion_catalogo,
+    _migracion_archivo,
+    _migracion_ventas,
+    _migracion_estados,
+    _migracion_archivo_client_id,
+]
+
+def _migrar(conn: sqlite3.Connection) -> None:
+    """Aplica en orden las migraciones pendientes, cada una en su transacción.
+
+    BEGIN IMMEDIATE toma el candado de escritura antes de leer la versión, así
+    que si arrancan dos procesos a la vez solo uno aplica cada paso; los
+    lectores en WAL siguen atendiendo mientras tanto.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(_MIGRACIONES):
+                conn.commit()
+                return
+            _MIGRACIONES[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _init_db():
+    DB_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with _get_conn() as conn:
+        # WAL: las lecturas ya no se bloquean mientras se inserta un pedido
+        conn.execute("PRAGMA journal_mode = WAL")
+        _migrar(conn)
 
 _init_db()
+_cargar_catalogo()
 
 # --- Modelos ---
 class Pedido(BaseModel):
@@ -76,9 +895,15 @@ class Pedido(BaseModel):
     total: float = 0.0
     estado: str = "pendiente"
     modo: Optional[str] = None
+    # UUID que genera el cliente; si el mismo pedido llega dos veces se
+    # regresa el id original en lugar de crear otro
+    client_id: Optional[str] = Field(default=None, max_length=64)
 
 class PedidoOffline(Pedido):
-    temp_id: Optional[str] = None
+    # Marcador local del dispositivo: solo sirve para armar ids_map en la
+    # respuesta. No es único entre dispositivos, así que nunca se usa como
+    # llave de idempotencia (para eso está client_id)
+    temp_id: Optional[str] = Field(default=None, max_length=64)
 
 class PedidoEstado(BaseModel):
     estado: str
@@ -86,29 +911,57 @@ class PedidoEstado(BaseModel):
 class PedidosSync(BaseModel):
     pedidos: List[PedidoOffline]
 
+class ProductoCatalogo(BaseModel):
+    id: int = Field(ge=1)
+    nombre: str = Field(min_length=1)
+    precio: float = Field(ge=0)
+    seccion: str = Field(min_length=1)
+    descripcion: str = ""
+    disponible: bool = True
+
+class CatalogoUpsert(BaseModel):
+    productos: List[ProductoCatalogo]
+
 # --- Helpers ---
 def _producto_por_id(pid: int) -> Optional[Dict[str, object]]:
-    return next((p for p in productos if p["id"] == pid), None)
+    return _catalogo.por_id.get(pid)
 
 def _serializar_pedido(data: Dict[str, object]) -> Dict[str, object]:
-    nombres = []
     lista_ids = data["productos"] if isinstance(data["productos"], list) else []
-    
-    for pid in lista_ids:
-        prod = _producto_por_id(pid)
-        if prod:
-            nombres.append(prod.get("nombre"))
+    nombres_por_id = _catalogo.nombres
+    nombres = [nombres_por_id[pid] for pid in lista_ids if pid in nombres_por_id]
     return {
         **data,
         "productos_nombres": nombres,
     }
 
-def _row_to_pedido(row: sqlite3.Row) -> Dict[str, object]:
-    productos_ids = []
-    try:
-        productos_ids = json.loads(row["productos"])
-    except Exception:
-        productos_ids = []
+def _productos_de(
+    conn: sqlite3.Connection, pedido_ids: List[int], tabla: str = "pedido_items"
+) -> Dict[int, List[int]]:
+    """Lista de ids de producto de cada pedido, leída de pedido_items (o su archivo)."""
+    resultado: Dict[int, List[int]] = {pid: [] for pid in pedido_ids}
+    # En lotes para no pasarnos del límite de parámetros de SQLite
+    for i in range(0, len(pedido_ids), 500):
+        lote = pedido_ids[i:i + 500]
+        marcas = ",".join("?" * len(lote))
+        for r in conn.execute(
+            f"""
+            SELECT pedido_id, producto_id, cantidad FROM {tabla}
+            WHERE pedido_id IN ({marcas})
+            ORDER BY pedido_id, posicion
+            """,
+            lote,
+        ):
+            resultado[r[0]].extend([r[1]] * r[2])
+    return resultado
+
+def _rows_to_pedidos(
+    conn: sqlite3.Connection, rows: List[sqlite3.Row], tabla_items: str = "pedido_items"
+) -> List[Dict[str, object]]:
+    productos = _productos_de(conn, [r["id"] for r in rows], tabla_items)
+    return [_row_to_pedido(r, productos[r["id"]]) for r in rows]
+
+def _row_to_pedido(row: sqlite3.Row, productos_ids: List[int]) -> Dict[str, object]:
     return {
         "id": row["id"],
         "productos": productos_ids,
@@ -116,83 +969,1270 @@ def _row_to_pedido(row: sqlite3.Row) -> Dict[str, object]:
         "estado": row["estado"],
         "modo": row["modo"],
         "created_at": row["created_at"],
+        "revision": row["revision"],
+        "client_id": row["client_id"],
     }
 
-def _insert_pedido(data: Pedido) -> int:
+# Cada INSERT/UPDATE toma la siguiente revisión global; SQLite serializa las
+# escrituras, así que el contador es monotónico sin necesitar otra tabla.
+_NEXT_REVISION_SQL = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM pedidos)"
+
+def _llave(data: Pedido) -> Optional[str]:
+    return data.client_id
+
+def _ids_existentes(conn: sqlite3.Connection, llaves: List[str]) -> Dict[str, int]:
+    # También en el archivo: un reintento tardío de un pedido ya archivado
+    # no debe crear otro. Cada lote se liga dos veces (una por tabla), así
+    # que va de 250 para no pasar de 999 parámetros (SQLite < 3.32)
+    existentes: Dict[str, int] = {}
+    for i in range(0, len(llaves), 250):
+        lote = llaves[i:i + 250]
+        marcas = ",".join("?" * len(lote))
+        existentes.update(
+            (r["client_id"], r["id"])
+            for r in conn.execute(
+                f"""
+                SELECT id, client_id FROM pedidos WHERE client_id IN ({marcas})
+                UNION ALL
+                SELECT id, client_id FROM pedidos_archivo WHERE client_id IN ({marcas})
+                """,
+                lote + lote,
+            )
+        )
+    return existentes
+
+@_medido
+def _insert_pedidos(pedidos: List[Pedido]) -> Tuple[List[int], List[int]]:
+    """Guarda varios pedidos en una sola transacción (un solo commit).
+
+    Con el candado de escritura tomado asignamos ids y revisiones nosotros
+    mismos, así todo el lote entra con dos executemany. Los pedidos cuya
+    llave de idempotencia ya existe no se vuelven a insertar.
+
+    Regresa el id de cada pedido (en el mismo orden) y los ids que se
+    crearon en esta llamada.
+    """
+    if not pedidos:
+        return [], []
+    precios = _catalogo.precios
+    ahora = datetime.now().isoformat()
+    llaves = [_llave(p) for p in pedidos]
     with _get_conn() as conn:
-        cur = conn.execute(
+        conn.execute("BEGIN IMMEDIATE")
+        conocidos = _ids_existentes(conn, [k for k in llaves if k])
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'pedidos'").fetchone()
+        siguiente_id = (int(row[0]) if row else 0) + 1
+        siguiente_rev = conn.execute("SELECT COALESCE(MAX(revision), 0) FROM pedidos").fetchone()[0] + 1
+
+        ids: List[int] = []
+        nuevos: List[Tuple[int, int, Pedido, Optional[str]]] = []
+        for data, llave in zip(pedidos, llaves):
+            if llave and llave in conocidos:
+                ids.append(conocidos[llave])
+                continue
+            ids.append(siguiente_id)
+            nuevos.append((siguiente_id, siguiente_rev, data, llave))
+            if llave:
+                conocidos[llave] = siguiente_id
+            siguiente_id += 1
+            siguiente_rev += 1
+
+        conn.executemany(
             """
-            INSERT INTO pedidos (productos, total, estado, modo, created_at) 
+            INSERT INTO pedidos (id, productos, total, estado, modo, created_at, revision, client_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    pedido_id,
+                    json.dumps(data.productos),
+                    float(data.total or 0),
+                    data.estado,
+                    data.modo,
+                    ahora,
+                    revision,
+                    llave,
+                )
+                for pedido_id, revision, data, llave in nuevos
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO pedido_items
+                (pedido_id, posicion, producto_id, cantidad, precio_unitario)
             VALUES (?, ?, ?, ?, ?)
             """,
+            [
+                (pedido_id, pos, pid, cant, precios.get(pid, 0.0))
+                for pedido_id, _, data, _ in nuevos
+                for pos, pid, cant in _agrupar_items(data.productos)
+            ],
+        )
+        _sumar_ventas(conn, (
             (
-                json.dumps(data.productos),
-                float(data.total or 0),
-                data.estado,
+                ahora,
                 data.modo,
-                datetime.now().isoformat(),
-            ),
+                float(data.total or 0),
+                [(pid, cant, precios.get(pid, 0.0)) for _, pid, cant in _agrupar_items(data.productos)],
+            )
+            for _, _, data, _ in nuevos
+        ))
+        conn.executemany(
+            "INSERT INTO pedido_estados (pedido_id, estado, momento) VALUES (?, ?, ?)",
+            [(pedido_id, data.estado, ahora) for pedido_id, _, data, _ in nuevos],
         )
-        conn.commit()
-        print(f"✅ Pedido guardado en DB. ID: {cur.lastrowid}") # LOG
-        return int(cur.lastrowid)
+        _vista.confirmar(conn, [
+            {
+                "id": pedido_id,
+                # Mismo orden que al leerlos de pedido_items
+                "productos": [
+                    pid for _, pid, cant in _agrupar_items(data.productos) for _ in range(cant)
+                ],
+                "total": float(data.total or 0),
+                "estado": data.estado,
+                "modo": data.modo,
+                "created_at": ahora,
+                "revision": revision,
+                "client_id": llave,
+            }
+            for pedido_id, revision, data, llave in nuevos
+        ])
+    creados = [n[0] for n in nuevos]
+    log.info("pedidos guardados", extra={"campos": {
+        "creados": len(creados),
+        "repetidos": len(ids) - len(creados),
+        "primer_id": creados[0] if creados else None,
+        "ultimo_id": creados[-1] if creados else None,
+    }})
+    return ids, creados
+
+def _insert_pedido(data: Pedido) -> int:
+    return _insert_pedidos([data])[0][0]
 
+@_medido
 def _update_estado(pedido_id: int, estado: str) -> bool:
-    print(f"🔄 Intentando actualizar pedido {pedido_id} a {estado}") # LOG
+    log.info("actualizando estado", extra={"campos": {"pedido_id": pedido_id, "estado": estado}})
     with _get_conn() as conn:
         cur = conn.execute(
-            "UPDATE pedidos SET estado = ? WHERE id = ?",
+            f"UPDATE pedidos SET estado = ?, revision = {_NEXT_REVISION_SQL} WHERE id = ?",
             (estado, pedido_id),
         )
-        conn.commit()
-        return cur.rowcount > 0
+        if cur.rowcount == 0:
+            return False
+        conn.execute(
+            "INSERT INTO pedido_estados (pedido_id, estado, momento) VALUES (?, ?, ?)",
+            (pedido_id, estado, datetime.now().isoformat()),
+        )
+        # Releemos el renglón (RETURNING no aplica la afinidad de la columna)
+        row = conn.execute("SELECT * FROM pedidos WHERE id = ?", (pedido_id,)).fetchone()
+        _vista.confirmar(conn, _rows_to_pedidos(conn, [row]))
+    if estado == "listo":
+        # Hay una muestra nueva de tiempo de preparación
+        _tiempos.invalidar()
+    return True
 
+@_medido
 def _get_pedido(pedido_id: int) -> Optional[Dict[str, object]]:
     with _get_conn() as conn:
         row = conn.execute("SELECT * FROM pedidos WHERE id = ?", (pedido_id,)).fetchone()
         if not row:
             return None
-        return _row_to_pedido(row)
+        return _rows_to_pedidos(conn, [row])[0]
 
-def _get_all_pedidos() -> List[Dict[str, object]]:
+@_medido
+def _get_pedidos(pedido_ids: List[int]) -> List[Dict[str, object]]:
+    """Varios pedidos por id con una sola consulta (en el orden pedido).
+
+    Los que ya no están en ``pedidos`` se buscan en el archivo.
+    """
+    resultado: Dict[int, Dict[str, object]] = {}
     with _get_conn() as conn:
-        rows = conn.execute("SELECT * FROM pedidos ORDER BY id DESC").fetchall()
-        return [_row_to_pedido(r) for r in rows]
+        for tabla, tabla_items in (("pedidos", "pedido_items"), ("pedidos_archivo", "pedido_items_archivo")):
+            faltan = [pid for pid in pedido_ids if pid not in resultado]
+            for i in range(0, len(faltan), 500):
+                lote = faltan[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT * FROM {tabla} WHERE id IN ({','.join('?' * len(lote))})",
+                    lote,
+                ).fetchall()
+                resultado.update((p["id"], p) for p in _rows_to_pedidos(conn, rows, tabla_items))
+    return [resultado[pid] for pid in pedido_ids if pid in resultado]
+
+def _filtro_estados(estados: Optional[List[str]]) -> Tuple[str, List[object]]:
+    if not estados:
+        return "", []
+    return f"estado IN ({','.join('?' * len(estados))})", list(estados)
+
+@_medido
+def _revision_actual() -> int:
+    with _get_conn() as conn:
+        return int(conn.execute("SELECT COALESCE(MAX(revision), 0) FROM pedidos").fetchone()[0])
+
+def _a_hora_local(momento: datetime) -> datetime:
+    """Pasa ``momento`` a hora local sin zona, como se guarda ``created_at``."""
+    if momento.tzinfo is not None:
+        return momento.astimezone().replace(tzinfo=None)
+    return momento
+
+@_medido
+def _get_all_pedidos(
+    *,
+    estados: Optional[List[str]] = None,
+    modo: Optional[str] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    archivados: bool = False,
+) -> List[Dict[str, object]]:
+    """Pedidos del más nuevo al más viejo, filtrados y paginados en SQL.
+
+    La paginación es por llave (``before_id``/``after_id``), así que cada
+    página cuesta lo mismo sin importar cuánto historial haya. Con
+    ``archivados`` se consulta el archivo en lugar de la tabla activa.
+    """
+    tabla, tabla_items = (
+        ("pedidos_archivo", "pedido_items_archivo") if archivados else ("pedidos", "pedido_items")
+    )
+    condiciones: List[str] = []
+    params: List[object] = []
+    sql_estados, params_estados = _filtro_estados(estados)
+    if sql_estados:
+        condiciones.append(sql_estados)
+        params.extend(params_estados)
+    if modo:
+        condiciones.append("modo LIKE ?")
+        params.append(f"%{modo}%")
+    if desde:
+        condiciones.append("created_at >= ?")
+        params.append(_a_hora_local(desde).isoformat())
+    if hasta:
+        condiciones.append("created_at < ?")
+        params.append(_a_hora_local(hasta).isoformat())
+    if before_id is not None:
+        condiciones.append("id < ?")
+        params.append(before_id)
+    if after_id is not None:
+        condiciones.append("id > ?")
+        params.append(after_id)
+
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    # Con after_id la página son los siguientes ids hacia arriba
+    orden = "ASC" if after_id is not None and before_id is None else "DESC"
+    sql = f"SELECT * FROM {tabla} {where} ORDER BY id {orden}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    with _get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+        if orden == "ASC":
+            rows.reverse()
+        return _rows_to_pedidos(conn, rows, tabla_items)
+
+@_medido
+def _get_pedidos_since(
+    revision: int, estados: Optional[List[str]] = None
+) -> Tuple[int, List[Dict[str, object]]]:
+    """Pedidos insertados o modificados después de ``revision``.
+
+    Regresa también la revisión actual para que el cliente la use como
+    cursor en la siguiente consulta. ``estados`` limita los pedidos que se
+    regresan, no la revisión.
+    """
+    sql_estados, params = _filtro_estados(estados)
+    where = f"revision > ? AND {sql_estados}" if sql_estados else "revision > ?"
+    with _get_conn() as conn:
+        # Ambas lecturas en la misma transacción para ver una sola foto de la tabla
+        conn.execute("BEGIN")
+        rows = conn.execute(
+            f"SELECT * FROM pedidos WHERE {where} ORDER BY revision",
+            [revision, *params],
+        ).fetchall()
+        # Un cursor muy viejo también debe enterarse de los que ya se archivaron
+        archivados = conn.execute(
+            f"SELECT * FROM pedidos_archivo WHERE {where} ORDER BY revision",
+            [revision, *params],
+        ).fetchall()
+        actual = conn.execute("SELECT COALESCE(MAX(revision), 0) FROM pedidos").fetchone()[0]
+        pedidos = _rows_to_pedidos(conn, rows)
+        if archivados:
+            pedidos.extend(_rows_to_pedidos(conn, archivados, "pedido_items_archivo"))
+            pedidos.sort(key=lambda p: p["revision"])
+        return int(actual), pedidos
+
+# --- Archivo y mantenimiento de la base ---
+ARCHIVO_ACTIVO = os.getenv("PIKO_ARCHIVO", "1") == "1"
+ARCHIVO_DIAS = float(os.getenv("PIKO_ARCHIVO_DIAS", "30"))
+ARCHIVO_LOTE = int(os.getenv("PIKO_ARCHIVO_LOTE", "1000"))
+ARCHIVO_CADA_HORAS = float(os.getenv("PIKO_ARCHIVO_CADA_HORAS", "6"))
+# VACUUM solo cuando las páginas libres pasan esta fracción del archivo
+VACUUM_FRACCION = float(os.getenv("PIKO_VACUUM_FRACCION", "0.25"))
+# Sube cada vez que se archiva algo: cambia qué pedidos hay en cada tabla sin
+# cambiar la revisión, así que entra en el ETag de las consultas
+_archivo_generacion = 0
+
+@_medido
+def _archivar_confirmados(antes: datetime, lote: int = ARCHIVO_LOTE) -> int:
+    """Pasa a ``pedidos_archivo`` los confirmados creados antes de ``antes``.
+
+    Va por lotes, cada uno en su transacción, para no detener las escrituras
+    de los kioscos mucho tiempo. El pedido con la revisión más alta nunca se
+    archiva: de él sale la siguiente revisión y el feed no debe retroceder.
+    """
+    global _archivo_generacion
+    total = 0
+    ahora = datetime.now().isoformat()
+    while True:
+        with _get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [
+                r[0]
+                for r in conn.execute(
+                    """
+                    SELECT id FROM pedidos
+                    WHERE estado = 'confirmado' AND created_at < ?
+                      AND revision < (SELECT MAX(revision) FROM pedidos)
+                    ORDER BY id
+                    LIMIT ?
+                    """,
+                    (antes.isoformat(), lote),
+                )
+            ]
+            if not ids:
+                break
+            marcas = ",".join("?" * len(ids))
+            conn.execute(
+                f"""
+                INSERT INTO pedidos_archivo
+                    (id, productos, total, estado, modo, created_at, revision, client_id, archivado_at)
+                SELECT id, productos, total, estado, modo, created_at, revision, client_id, ?
+                FROM pedidos WHERE id IN ({marcas})
+                """,
+                [ahora, *ids],
+            )
+            conn.execute(
+                f"INSERT INTO pedido_items_archivo SELECT * FROM pedido_items WHERE pedido_id IN ({marcas})",
+                ids,
+            )
+            conn.execute(f"DELETE FROM pedido_items WHERE pedido_id IN ({marcas})", ids)
+            conn.execute(f"DELETE FROM pedidos WHERE id IN ({marcas})", ids)
+        total += len(ids)
+        _archivo_generacion += 1
+        if len(ids) < lote:
+            break
+    return total
+
+@_medido
+def _mantenimiento(dias: float = ARCHIVO_DIAS) -> Dict[str, object]:
+    """Archiva, actualiza estadísticas, recorta el WAL y, si hace falta, compacta."""
+    inicio = time.perf_counter()
+    archivados = _archivar_confirmados(datetime.now() - timedelta(days=dias))
+    with _pool.connection() as conn:
+        # Fuera de transacción: VACUUM y el checkpoint no corren dentro de una
+        conn.execute("PRAGMA optimize")
+        if archivados:
+            conn.execute("ANALYZE")
+        paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        compactado = bool(paginas) and libres / paginas > VACUUM_FRACCION
+        if compactado:
+            conn.execute("VACUUM")
+        checkpoint = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    resultado = {
+        "archivados": archivados,
+        "paginas": paginas,
+        "paginas_libres": libres,
+        "vacuum": compactado,
+        "wal_ocupado": bool(checkpoint[0]),
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
+    log.info("mantenimiento de la base", extra={"campos": resultado})
+    return resultado
+
+async def _archivar_periodicamente() -> None:
+    # La primera vuelta espera un minuto para no competir con el arranque
+    await asyncio.sleep(60)
+    while True:
+        try:
+            await _db(_mantenimiento)
+        except Exception:
+            log.exception("error en el mantenimiento de la base")
+        await asyncio.sleep(ARCHIVO_CADA_HORAS * 3600)
+
+# --- Reportes de ventas ---
+AGRUPACIONES_VENTAS = ("hora", "dia", "producto", "seccion", "consumo", "pago")
+_CLAVES_VENTAS_HORA = {
+    "hora": "hora",
+    "dia": "substr(hora, 1, 10)",
+    "consumo": "consumo",
+    "pago": "pago",
+}
+
+def _hora_clave(momento: datetime, redondear_arriba: bool = False) -> str:
+    """Llave de hora ("YYYY-MM-DDTHH") en la hora local con que se guardan los pedidos."""
+    momento = _a_hora_local(momento)
+    if redondear_arriba and (momento.minute or momento.second or momento.microsecond):
+        momento += timedelta(hours=1)
+    return momento.isoformat()[:13]
+
+@_medido
+def _reporte_ventas(
+    agrupar: str, desde: Optional[str] = None, hasta: Optional[str] = None
+) -> Dict[str, object]:
+    """Totales de venta agrupados, leídos de los acumulados por hora.
+
+    ``desde`` y ``hasta`` son llaves de hora (la segunda exclusiva). Por hora,
+    día, consumo y pago el importe es el total cobrado de cada pedido; por
+    producto y sección es cantidad por precio unitario de sus renglones.
+    """
+    condiciones: List[str] = []
+    params: List[object] = []
+    if desde:
+        condiciones.append("hora >= ?")
+        params.append(desde)
+    if hasta:
+        condiciones.append("hora < ?")
+        params.append(hasta)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    with _get_conn() as conn:
+        # Filas y totales de la misma foto de la base
+        conn.execute("BEGIN")
+        total = conn.execute(
+            f"SELECT COALESCE(SUM(pedidos), 0), COALESCE(SUM(importe), 0) FROM ventas_hora {where}",
+            params,
+        ).fetchone()
+        if agrupar in _CLAVES_VENTAS_HORA:
+            filas = [
+                {"clave": r[0], "pedidos": r[1], "importe": round(r[2], 2)}
+                for r in conn.execute(
+                    f"""
+                    SELECT {_CLAVES_VENTAS_HORA[agrupar]} AS clave, SUM(pedidos), SUM(importe)
+                    FROM ventas_hora {where}
+                    GROUP BY clave ORDER BY clave
+                    """,
+                    params,
+                )
+            ]
+        else:
+            por_producto = conn.execute(
+                f"""
+                SELECT producto_id, SUM(cantidad), SUM(importe)
+                FROM ventas_productos_hora {where}
+                GROUP BY producto_id
+                """,
+                params,
+            ).fetchall()
+            por_id = _catalogo.por_id
+            if agrupar == "producto":
+                filas = [
+                    {
+                        "clave": pid,
+                        "nombre": por_id.get(pid, {}).get("nombre", f"Producto {pid}"),
+                        "seccion": por_id.get(pid, {}).get("seccion", SIN_ESPECIFICAR),
+                        "cantidad": cantidad,
+                        "importe": round(importe, 2),
+                    }
+                    for pid, cantidad, importe in por_producto
+                ]
+            else:
+                secciones: Dict[str, List[float]] = {}
+                for pid, cantidad, importe in por_producto:
+                    seccion = str(por_id.get(pid, {}).get("seccion", SIN_ESPECIFICAR))
+                    acumulado = secciones.setdefault(seccion, [0, 0.0])
+                    acumulado[0] += cantidad
+                    acumulado[1] += importe
+                filas = [
+                    {"clave": seccion, "cantidad": cantidad, "importe": round(importe, 2)}
+                    for seccion, (cantidad, importe) in secciones.items()
+                ]
+            filas.sort(key=lambda f: (-f["importe"], str(f["clave"])))
+    return {
+        "agrupar": agrupar,
+        "desde": desde,
+        "hasta": hasta,
+        "filas": filas,
+        "total": {"pedidos": total[0], "importe": round(total[1], 2)},
+    }
+
+# --- Vista en memoria de los pedidos activos ---
+ESTADOS_CERRADOS = frozenset({"confirmado"})
+# Pedidos cerrados recientes que se conservan para el feed ?since=
+VISTA_CERRADOS_MAX = int(os.getenv("PIKO_VISTA_CERRADOS_MAX", "2000"))
+
+class _VistaActivos:
+    """Pedidos activos (y los que cambiaron hace poco) ya serializados.
+
+    Los polls de baristas y pantallas solo necesitan los pedidos que no
+    están confirmados, así que los tenemos en memoria y se contestan sin
+    tocar SQLite. Los escritores la actualizan con ``confirmar`` justo al
+    hacer commit, en el mismo orden que los commits, así la revisión de la
+    vista nunca se adelanta a un cambio que no tenga. Por la misma razón de
+    aquí salen los eventos del stream: en orden de revisión.
+
+    Además de los activos guarda los últimos ``VISTA_CERRADOS_MAX`` pedidos
+    que se cerraron, para que un cliente con ``since`` reciente se entere de
+    que salieron. Si ``since`` es anterior a ``piso`` hay que ir a la base.
+    """
+
+    def __init__(self):
+        # _orden serializa commit + aplicar entre escritores; _datos protege
+        # las lecturas y nunca se sostiene durante un commit
+        self._orden = threading.Lock()
+        self._datos = threading.Lock()
+        # id -> [pedido crudo, serializado, versión del catálogo con que se serializó]
+        self._pedidos: Dict[int, List[object]] = {}
+        self._cerrados: "OrderedDict[int, int]" = OrderedDict()  # id -> revisión
+        self.revision = 0
+        self.piso = 0
+
+    def reconstruir(self) -> None:
+        """Carga los pedidos activos desde SQLite (al arrancar)."""
+        cerrados = sorted(ESTADOS_CERRADOS)
+        with _get_conn() as conn:
+            conn.execute("BEGIN")
+            rows = conn.execute(
+                f"SELECT * FROM pedidos WHERE estado NOT IN ({','.join('?' * len(cerrados))})",
+                cerrados,
+            ).fetchall()
+            revision = int(conn.execute("SELECT COALESCE(MAX(revision), 0) FROM pedidos").fetchone()[0])
+            pedidos = _rows_to_pedidos(conn, rows)
+        with self._datos:
+            self._pedidos = {int(p["id"]): [p, None, None] for p in pedidos}
+            self._cerrados.clear()
+            self.revision = self.piso = revision
+
+    def confirmar(self, conn: sqlite3.Connection, pedidos: List[Dict[str, object]]) -> None:
+        """Hace commit de ``conn`` y aplica ``pedidos`` (ya guardados) a la vista."""
+        with self._orden:
+            conn.commit()
+            evento = None
+            with self._datos:
+                for p in pedidos:
+                    self._aplicar(p)
+                if pedidos and _hub.hay_suscriptores():
+                    evento = {
+                        "revision": max(int(p["revision"]) for p in pedidos),
+                        "pedidos": [self._serializado(self._pedidos[int(p["id"])]) for p in pedidos],
+                    }
+                while len(self._cerrados) > VISTA_CERRADOS_MAX:
+                    pid, revision = self._cerrados.popitem(last=False)
+                    del self._pedidos[pid]
+                    self.piso = max(self.piso, revision)
+            # Todavía con _orden tomado: el evento entra al loop detrás del
+            # del commit anterior, aunque este hilo le gane al otro al salir
+            if evento is not None:
+                _hub.publicar_en_orden(evento)
+
+    def _aplicar(self, pedido: Dict[str, object]) -> None:
+        pid = int(pedido["id"])
+        revision = int(pedido["revision"])
+        self._pedidos[pid] = [pedido, None, None]
+        self._cerrados.pop(pid, None)
+        if pedido["estado"] in ESTADOS_CERRADOS:
+            # Se agregan en orden de revisión: el primero es el más viejo
+            self._cerrados[pid] = revision
+        self.revision = max(self.revision, revision)
+
+    def _serializado(self, entrada: List[object]) -> Dict[str, object]:
+        # Se serializa una vez por versión del catálogo (los nombres pueden cambiar)
+        if entrada[2] != _catalogo.version:
+            entrada[1] = _serializar_pedido(entrada[0])
+            entrada[2] = _catalogo.version
+        return entrada[1]
+
+    def cambios_desde(
+        self, revision: int, estados: Optional[List[str]] = None
+    ) -> Optional[Tuple[int, List[Dict[str, object]]]]:
+        """Igual que ``_get_pedidos_since`` pero en memoria; None si no alcanza."""
+        with self._datos:
+            if revision == 0:
+                # Foto completa: solo la tenemos si piden puros estados activos
+                if not estados or not ESTADOS_CERRADOS.isdisjoint(estados):
+                    return None
+            elif revision < self.piso:
+                return None
+            entradas = [
+                e for e in self._pedidos.values()
+                if e[0]["revision"] > revision and (not estados or e[0]["estado"] in estados)
+            ]
+            entradas.sort(key=lambda e: e[0]["revision"])
+            return self.revision, [self._serializado(e) for e in entradas]
+
+    def listar(self, estados: Optional[List[str]], limit: Optional[int]) -> Optional[List[Dict[str, object]]]:
+        """Pedidos en ``estados`` (todos activos) del más nuevo al más viejo."""
+        if not estados or not ESTADOS_CERRADOS.isdisjoint(estados):
+            return None
+        with self._datos:
+            entradas = [e for e in self._pedidos.values() if e[0]["estado"] in estados]
+            entradas.sort(key=lambda e: e[0]["id"], reverse=True)
+            if limit is not None:
+                entradas = entradas[:limit]
+            return [self._serializado(e) for e in entradas]
+
+    def obtener(self, pedido_ids: Iterable[int]) -> Dict[int, Dict[str, object]]:
+        with self._datos:
+            return {
+                pid: self._serializado(self._pedidos[pid])
+                for pid in pedido_ids
+                if pid in self._pedidos
+            }
+
+_vista = _VistaActivos()
+_vista.reconstruir()
+
+async def _pedidos_serializados(pedido_ids: List[int]) -> List[Dict[str, object]]:
+    """Pedidos por id ya serializados: de la vista y, si falta alguno, de la base."""
+    encontrados = _vista.obtener(pedido_ids)
+    faltan = [pid for pid in pedido_ids if pid not in encontrados]
+    if faltan:
+        for p in await _db(_get_pedidos, faltan):
+            encontrados[int(p["id"])] = _serializar_pedido(p)
+    return [encontrados[pid] for pid in pedido_ids if pid in encontrados]
+
+async def _cambios_desde(
+    revision: int, estados: Optional[List[str]] = None
+) -> Tuple[int, List[Dict[str, object]]]:
+    resultado = _vista.cambios_desde(revision, estados)
+    if resultado is None:
+        actual, pedidos = await _db(_get_pedidos_since, revision, estados)
+        resultado = actual, [_serializar_pedido(p) for p in pedidos]
+    return resultado
+
+# --- Cola de producción ---
+PRODUCCION_ESTADOS = ("pendiente", "preparando")
+# Pedidos que se pueden preparar a la vez (baristas o máquinas)
+PRODUCCION_ESTACIONES = max(1, int(os.getenv("PIKO_PRODUCCION_ESTACIONES", "1")))
+# Últimos pedidos terminados que se usan para estimar tiempos
+PRODUCCION_MUESTRAS = int(os.getenv("PIKO_PRODUCCION_MUESTRAS", "500"))
+# Segundos por unidad mientras no haya historia
+PRODUCCION_SEGUNDOS = float(os.getenv("PIKO_PRODUCCION_SEGUNDOS", "90"))
+# Preparaciones más largas se descartan (alguien olvidó marcar "listo")
+PRODUCCION_DURACION_MAX = float(os.getenv("PIKO_PRODUCCION_DURACION_MAX", "3600"))
+# Con menos muestras de un producto se usa la mediana general
+PRODUCCION_MUESTRAS_MIN = 3
+
+class _TiemposPreparacion:
+    """Segundos por unidad de cada producto, medidos de preparando → listo.
+
+    La duración de cada pedido terminado se reparte entre sus unidades y
+    esa cifra cuenta como muestra para cada producto que llevaba; por
+    producto se toma la mediana. Solo se recalcula cuando algún pedido
+    pasó a listo desde la última vez.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vigente = False
+        self.por_producto: Mapping[int, float] = MappingProxyType({})
+        self.general = PRODUCCION_SEGUNDOS
+        self.muestras = 0
+
+    def invalidar(self) -> None:
+        self._vigente = False
+
+    def segundos(self, pid: int) -> float:
+        return self.por_producto.get(pid, self.general)
+
+    def actualizar(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if self._vigente:
+                return
+            # Se marca antes de leer: si llega otro "listo" mientras tanto,
+            # la siguiente consulta vuelve a calcular
+            self._vigente = True
+            try:
+                self._calcular(conn)
+            except Exception:
+                self._vigente = False
+                raise
+
+    def _calcular(self, conn: sqlite3.Connection) -> None:
+        duraciones: Dict[int, float] = {}
+        for pedido_id, inicio, fin in conn.execute(
+            """
+            SELECT l.pedido_id,
+                   (SELECT MAX(p.momento) FROM pedido_estados p
+                    WHERE p.pedido_id = l.pedido_id AND p.estado = 'preparando'
+                      AND p.momento <= l.momento),
+                   l.momento
+            FROM pedido_estados l
+            WHERE l.estado = 'listo'
+            ORDER BY l.id DESC
+            LIMIT ?
+            """,
+            (PRODUCCION_MUESTRAS,),
+        ):
+            # Si un pedido se marcó listo dos veces vale la más reciente
+            if inicio is None or pedido_id in duraciones:
+                continue
+            segundos = (datetime.fromisoformat(fin) - datetime.fromisoformat(inicio)).total_seconds()
+            if 0 < segundos <= PRODUCCION_DURACION_MAX:
+                duraciones[pedido_id] = segundos
+
+        renglones: Dict[int, List[Tuple[int, int]]] = {}
+        ids = list(duraciones)
+        for tabla in ("pedido_items", "pedido_items_archivo"):
+            for i in range(0, len(ids), 500):
+                lote = ids[i:i + 500]
+                for r in conn.execute(
+                    f"""
+                    SELECT pedido_id, producto_id, cantidad FROM {tabla}
+                    WHERE pedido_id IN ({','.join('?' * len(lote))})
+                    """,
+                    lote,
+                ):
+                    renglones.setdefault(r[0], []).append((r[1], r[2]))
+
+        general: List[float] = []
+        por_producto: Dict[int, List[float]] = {}
+        for pedido_id, segundos in duraciones.items():
+            items = renglones.get(pedido_id)
+            if not items:
+                continue
+            por_unidad = segundos / sum(cantidad for _, cantidad in items)
+            general.append(por_unidad)
+            for pid, _ in items:
+                por_producto.setdefault(pid, []).append(por_unidad)
+        self.general = statistics.median(general) if general else PRODUCCION_SEGUNDOS
+        self.por_producto = MappingProxyType({
+            pid: statistics.median(muestras)
+            for pid, muestras in por_producto.items()
+            if len(muestras) >= PRODUCCION_MUESTRAS_MIN
+        })
+        self.muestras = len(general)
+
+_tiempos = _TiemposPreparacion()
+
+@_medido
+def _inicios_preparacion(pedido_ids: List[int]) -> Dict[int, str]:
+    """Cuándo pasó cada pedido (por última vez) a preparando; de paso refresca los tiempos."""
+    with _get_conn() as conn:
+        _tiempos.actualizar(conn)
+        inicios: Dict[int, str] = {}
+        for i in range(0, len(pedido_ids), 500):
+            lote = pedido_ids[i:i + 500]
+            inicios.update(
+                (r[0], r[1])
+                for r in conn.execute(
+                    f"""
+                    SELECT pedido_id, MAX(momento) FROM pedido_estados
+                    WHERE estado = 'preparando' AND pedido_id IN ({','.join('?' * len(lote))})
+                    GROUP BY pedido_id
+                    """,
+                    lote,
+                )
+            )
+        return inicios
+
+def _cola_produccion(
+    activos: List[Dict[str, object]], inicios: Mapping[int, str], ahora: datetime
+) -> Dict[str, object]:
+    """Lista de preparación agrupada por producto y hora estimada de cada pedido.
+
+    Se atienden primero los pedidos que ya se están preparando (por hora de
+    inicio) y luego los pendientes del más viejo al más nuevo; cada uno ocupa
+    la primera estación que se libere. Los lotes salen en ese mismo orden y
+    su hora estimada es la del último pedido que los necesita.
+    """
+    def prioridad(p: Dict[str, object]) -> Tuple[int, str, int]:
+        if p["estado"] == "preparando":
+            return 0, inicios.get(p["id"], ""), p["id"]
+        return 1, "", p["id"]
+
+    catalogo = _catalogo.por_id
+    estaciones = [ahora] * PRODUCCION_ESTACIONES
+    pedidos: List[Dict[str, object]] = []
+    lotes: Dict[int, Dict[str, object]] = {}
+    for p in sorted(activos, key=prioridad):
+        renglones = _agrupar_items(p["productos"])
+        trabajo = sum(_tiempos.segundos(pid) * cantidad for _, pid, cantidad in renglones)
+        restante = trabajo
+        inicio = inicios.get(p["id"]) if p["estado"] == "preparando" else None
+        if inicio:
+            restante = max(0.0, trabajo - (ahora - datetime.fromisoformat(inicio)).total_seconds())
+        listo = heapq.heappop(estaciones) + timedelta(seconds=restante)
+        heapq.heappush(estaciones, listo)
+        listo_estimado = listo.isoformat(timespec="seconds")
+        pedidos.append({
+            "id": p["id"],
+            "estado": p["estado"],
+            "segundos": round(trabajo),
+            "listo_estimado": listo_estimado,
+        })
+        for _, pid, cantidad in renglones:
+            lote = lotes.get(pid)
+            if lote is None:
+                producto = catalogo.get(pid, {})
+                lote = lotes[pid] = {
+                    "producto_id": pid,
+                    "nombre": producto.get("nombre", f"Producto {pid}"),
+                    "seccion": producto.get("seccion", SIN_ESPECIFICAR),
+                    "cantidad": 0,
+                    "en_preparacion": 0,
+                    "segundos_por_unidad": round(_tiempos.segundos(pid), 1),
+                    "listo_estimado": None,
+                    "pedidos": [],
+                }
+            lote["cantidad"] += cantidad
+            if p["estado"] == "preparando":
+                lote["en_preparacion"] += cantidad
+            lote["pedidos"].append({"id": p["id"], "cantidad": cantidad, "estado": p["estado"]})
+            lote["listo_estimado"] = listo_estimado
+    return {
+        "generado": ahora.isoformat(timespec="seconds"),
+        "estaciones": PRODUCCION_ESTACIONES,
+        "muestras": _tiempos.muestras,
+        "lotes": list(lotes.values()),
+        "pedidos": pedidos,
+    }
+
+# --- Pub/sub de eventos de pedidos (para el stream en vivo) ---
+STREAM_PING_SECONDS = 15
+STREAM_QUEUE_SIZE = 256
+
+class _PedidosHub:
+    """Reparte los cambios de pedidos a todos los streams suscritos.
+
+    Cada suscriptor tiene su propia cola; si un cliente se queda tan atrás
+    que la llena, se le corta el stream para que reconecte y se ponga al día
+    con ``since`` en vez de acumular eventos sin límite.
+    """
+
+    def __init__(self):
+        self._subs: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Se prende al recibir la señal de apagado (ver _enganchar_apagado)
+        self.apagando = False
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._loop = asyncio.get_running_loop()
+        if self.apagando:
+            q.put_nowait(None)  # llegó tarde: el stream termina de inmediato
+            return q
+        self._subs.add(q)
+        return q
+
+    def hay_suscriptores(self) -> bool:
+        return bool(self._subs)
+
+    def publicar_en_orden(self, evento: Dict[str, object]) -> None:
+        """Publica desde cualquier hilo (el de la base, al hacer commit).
+
+        call_soon_threadsafe respeta el orden de llamada, así que si quien
+        llama tiene los commits serializados los eventos salen en ese orden.
+        """
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.publish, evento)
+        except RuntimeError:
+            pass  # el loop ya cerró: no queda nadie escuchando
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        self._subs.discard(q)
+
+    def publish(self, evento: Dict[str, object]) -> None:
+        for q in list(self._subs):
+            try:
+                q.put_nowait(evento)
+            except asyncio.QueueFull:
+                self._expulsar(q)
+
+    def close(self) -> None:
+        for q in list(self._subs):
+            self._expulsar(q)
+
+    def apagar(self) -> None:
+        """Corta los streams porque el servidor se está apagando.
+
+        Se llama desde el manejador de señales, así que el cierre se agenda
+        en el loop en lugar de tocar las colas aquí.
+        """
+        self.apagando = True
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.close)
+        except RuntimeError:
+            pass  # el loop ya cerró
+
+    def _expulsar(self, q: asyncio.Queue) -> None:
+        # None le indica al stream que termine
+        self._subs.discard(q)
+        while not q.empty():
+            q.get_nowait()
+        q.put_nowait(None)
+
+_hub = _PedidosHub()
+
+def _enganchar_apagado() -> None:
+    """Corta los streams en cuanto uvicorn recibe SIGTERM/SIGINT.
+
+    uvicorn espera a que se cierren todas las conexiones antes de correr el
+    apagado del lifespan, y un stream con pings nunca se cierra solo: sin
+    esto el proceso se queda esperando hasta que lo matan con SIGKILL y la
+    cola de ingesta no se vacía. Igual que sse-starlette, envolvemos
+    ``Server.handle_exit``.
+    """
+    try:
+        from uvicorn.server import Server
+    except ImportError:
+        return
+    original = Server.handle_exit
+    if getattr(original, "_piko_hub", False):
+        return
+
+    def handle_exit(self, sig, frame):
+        _hub.apagar()
+        original(self, sig, frame)
+
+    handle_exit._piko_hub = True
+    Server.handle_exit = handle_exit
+
+_enganchar_apagado()
+
+# --- Ingesta de pedidos con group commit ---
+INGESTA_ESPERA_MS = float(os.getenv("PIKO_INGESTA_ESPERA_MS", "2"))
+INGESTA_GRUPO_MAX = int(os.getenv("PIKO_INGESTA_GRUPO_MAX", "200"))
+
+class _IngestaPedidos:
+    """Junta los pedidos que llegan casi al mismo tiempo en una sola transacción.
+
+    Cada request deja su pedido en la cola y espera su future. Una sola
+    tarea escritora toma lo que haya (esperando unos milisegundos a que se
+    junten más), lo guarda con un commit y hasta entonces le contesta a cada
+    quien su id: un pedido confirmado ya quedó escrito en la base.
+    """
+
+    def __init__(self):
+        self._cola: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def agregar(self, pedido: Pedido) -> Tuple[int, bool]:
+        """Regresa el id del pedido y si se creó ahora (False si era un reintento)."""
+        cola = self._asegurar()
+        futuro = asyncio.get_running_loop().create_future()
+        cola.put_nowait((pedido, futuro))
+        return await futuro
+
+    def _asegurar(self) -> asyncio.Queue:
+        # La tarea vive en el loop del servidor; si el loop cambió (p. ej. otro
+        # TestClient) se arranca una nueva con su propia cola
+        loop = asyncio.get_running_loop()
+        tarea = self._tarea
+        if tarea is not None and not tarea.done() and tarea.get_loop() is loop:
+            return self._cola
+        if tarea is None or tarea.get_loop() is not loop:
+            self._cola = asyncio.Queue()
+        # Si la anterior murió en este mismo loop se conserva su cola, para que
+        # los pedidos que ya estaban esperando se guarden igual
+        self._tarea = loop.create_task(self._escribir(self._cola))
+        return self._cola
+
+    async def _escribir(self, cola: asyncio.Queue) -> None:
+        # La tarea heredó el contexto del request que la arrancó; sus grupos
+        # mezclan varios requests, así que no llevan request id
+        _request_id.set(None)
+        while True:
+            grupo = [await cola.get()]
+            try:
+                if INGESTA_ESPERA_MS > 0:
+                    await asyncio.sleep(INGESTA_ESPERA_MS / 1000)
+                while len(grupo) < INGESTA_GRUPO_MAX and not cola.empty():
+                    grupo.append(cola.get_nowait())
+                await self._guardar(grupo)
+            except Exception as exc:
+                # La escritora no puede morir: los que esperan en la cola se
+                # quedarían colgados. Este grupo se contesta con el error.
+                log.exception("error en la ingesta de pedidos", extra={"campos": {"pedidos": len(grupo)}})
+                for _, futuro in grupo:
+                    if not futuro.done():
+                        futuro.set_exception(exc)
+
+    async def _guardar(self, grupo: List[Tuple[Pedido, asyncio.Future]]) -> None:
+        # Los requests que ya se cancelaron no se escriben
+        grupo = [(p, f) for p, f in grupo if not f.done()]
+        if not grupo:
+            return
+        try:
+            ids, creados = await _db(_insert_pedidos, [p for p, _ in grupo])
+        except Exception as exc:
+            if len(grupo) > 1:
+                # La transacción se deshizo completa; de uno en uno, solo el
+                # pedido que la tumbó recibe el error
+                log.warning("grupo rechazado, se reintenta por pedido", extra={"campos": {
+                    "pedidos": len(grupo), "error": repr(exc),
+                }})
+                for item in grupo:
+                    await self._guardar([item])
+                return
+            log.exception("error guardando pedido")
+            _, futuro = grupo[0]
+            if not futuro.done():
+                futuro.set_exception(exc)
+            return
+        # Solo la primera aparición de un id nuevo cuenta como creada; las
+        # repeticiones dentro del mismo grupo son reintentos
+        pendientes = set(creados)
+        for pedido_id, (_, futuro) in zip(ids, grupo):
+            creado = pedido_id in pendientes
+            pendientes.discard(pedido_id)
+            if not futuro.done():
+                futuro.set_result((pedido_id, creado))
+
+    async def cerrar(self) -> None:
+        tarea, cola = self._tarea, self._cola
+        self._tarea = self._cola = None
+        if tarea is None:
+            return
+        tarea.cancel()
+        try:
+            await tarea
+        except asyncio.CancelledError:
+            pass
+        # Lo que alcanzó a entrar a la cola se guarda antes de apagar
+        restantes = []
+        while cola is not None and not cola.empty():
+            restantes.append(cola.get_nowait())
+        if restantes:
+            await self._guardar(restantes)
+
+_ingesta = _IngestaPedidos()
+
+def _sse(evento: str, data: Dict[str, object]) -> str:
+    return f"event: {evento}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+PEDIDOS_LIMIT_MAX = 500
+
+def _normalizar_estados(estados: Optional[List[str]]) -> Optional[List[str]]:
+    # Acepta ?estado=a&estado=b y también ?estado=a,b
+    if not estados:
+        return None
+    limpios = {e.strip().lower() for valor in estados for e in valor.split(",") if e.strip()}
+    return sorted(limpios) or None
+
+def _estados_para_feed(since: int, estados: Optional[List[str]]) -> Optional[List[str]]:
+    # En la carga inicial (since=0) el filtro evita bajar todo el historial.
+    # Después hay que mandar todos los cambios, incluidos los pedidos que
+    # salieron del filtro, para que el cliente pueda quitarlos de su lista.
+    return estados if since == 0 else None
+
+SYNC_LOTE_MAX = 1000
+
+def _productos_desconocidos(productos_ids: Iterable[int]) -> List[int]:
+    por_id = _catalogo.por_id
+    return sorted({pid for pid in productos_ids if pid not in por_id})
+
+def _validar_lote(pedidos: List[PedidoOffline]) -> List[str]:
+    if len(pedidos) > SYNC_LOTE_MAX:
+        return [f"El lote excede {SYNC_LOTE_MAX} pedidos"]
+    errores: List[str] = []
+    vistos: Set[str] = set()
+    for i, item in enumerate(pedidos):
+        ref = item.temp_id or f"#{i}"
+        if not item.productos:
+            errores.append(f"Pedido {ref}: sin productos")
+        desconocidos = _productos_desconocidos(item.productos)
+        if desconocidos:
+            errores.append(f"Pedido {ref}: productos desconocidos {desconocidos}")
+        if not (item.estado or "").strip():
+            errores.append(f"Pedido {ref}: estado vacío")
+        if item.temp_id:
+            if item.temp_id in vistos:
+                errores.append(f"Pedido {ref}: temp_id repetido")
+            vistos.add(item.temp_id)
+    return errores
+
+# --- ETags / GET condicional ---
+def _etag_coincide(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (e.strip().removeprefix("W/") for e in header.split(","))
+
+def _elegir_encoding(request: Request, disponibles: Mapping[str, bytes]) -> str:
+    aceptados = set()
+    for parte in request.headers.get("accept-encoding", "").split(","):
+        nombre, _, params = parte.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        aceptados.add(nombre.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in disponibles and (encoding in aceptados or "*" in aceptados):
+            return encoding
+    return "identity"
+
+def _no_modificado(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def _json_pedidos(contenido: object, etag: str) -> Response:
+    # Los pedidos ya son tipos de JSON: json.dumps directo es mucho más rápido
+    # que pasar miles de dicts por jsonable_encoder (y no frena el loop)
+    return Response(
+        content=json.dumps(contenido, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
+
+def _etag_pedidos(request: Request, revision: int) -> str:
+    """ETag de una consulta de pedidos.
+
+    El contenido solo depende de la revisión de la tabla, de los filtros de
+    la consulta y de los nombres del catálogo, así que no hace falta leer
+    los pedidos para saber si el cliente ya tiene la respuesta.
+    """
+    consulta = sorted(request.query_params.multi_items())
+    huella = hashlib.sha1(
+        repr((revision, _catalogo.nombres_huella, _archivo_generacion, consulta)).encode()
+    ).hexdigest()[:16]
+    return f'"pedidos-{revision}-{huella}"'
 
 # --- Endpoints ---
 
 @app.get("/api/menu")
-async def get_menu():
-    return sorted(productos, key=lambda p: (p.get("seccion", ""), p.get("nombre", "")))
+async def get_menu(request: Request):
+    # Se sirven los bytes precalculados del catálogo: sin ordenar, sin
+    # pasar por jsonable_encoder y sin comprimir en cada request
+    catalogo = _catalogo
+    encoding = _elegir_encoding(request, catalogo.menu_cuerpos)
+    etag = catalogo.menu_etags[encoding]
+    if any(_etag_coincide(request, e) for e in catalogo.menu_etags.values()):
+        return _no_modificado(etag)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=catalogo.menu_cuerpos[encoding],
+        media_type="application/json",
+        headers=headers,
+    )
 
 @app.post("/api/pedidos")
 async def create_pedido(pedido: Pedido):
-    print(f"📥 Recibiendo pedido nuevo: {pedido}") # LOG
+    log.debug("pedido recibido", extra={"campos": {
+        "productos": len(pedido.productos),
+        "modo": pedido.modo,
+        "client_id": pedido.client_id,
+    }})
+    # Se revisa antes de entrar a la cola: un id inválido no debe tumbar el
+    # grupo de commit de los demás kioscos
+    desconocidos = _productos_desconocidos(pedido.productos)
+    if desconocidos:
+        raise HTTPException(status_code=422, detail=f"Productos desconocidos: {desconocidos}")
     # Recalcular total para seguridad (opcional)
-    total_calc = 0.0
-    for pid in pedido.productos:
-        prod = _producto_por_id(pid)
-        if prod:
-            total_calc += float(prod.get("precio", 0))
-    
+    precios = _catalogo.precios
+    total_calc = sum(precios.get(pid, 0.0) for pid in pedido.productos)
+
     # Si el cálculo coincide más o menos, o si confiamos en el front, usamos el del front
     # Aquí forzamos el cálculo del backend si no viene total
     if total_calc > 0:
         pedido.total = total_calc
 
-    pedido_id = _insert_pedido(pedido)
+    # Se guarda junto con los demás pedidos que lleguen en estos milisegundos
+    pedido_id, creado = await _ingesta.agregar(pedido)
+    if not creado:
+        # Reintento de un pedido que ya teníamos (mismo client_id)
+        return {"mensaje": "Pedido ya registrado", "id": pedido_id}
     return {"mensaje": "Pedido creado", "id": pedido_id}
 
 @app.get("/api/pedidos")
-async def get_pedidos():
-    return [_serializar_pedido(p) for p in _get_all_pedidos()]
+async def get_pedidos(
+    request: Request,
+    since: Optional[int] = Query(default=None, ge=0),
+    estado: Optional[List[str]] = Query(default=None),
+    modo: Optional[str] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    before_id: Optional[int] = Query(default=None, ge=0),
+    after_id: Optional[int] = Query(default=None, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=PEDIDOS_LIMIT_MAX),
+    archivados: bool = False,
+):
+    estados = _normalizar_estados(estado)
+    # La vista conoce la revisión de todos los commits hechos por este proceso
+    etag = _etag_pedidos(request, _vista.revision)
+    if _etag_coincide(request, etag):
+        return _no_modificado(etag)
+
+    if since is None:
+        if not (archivados or modo or desde or hasta or before_id is not None or after_id is not None):
+            # Solo filtro por estados activos: sale de la vista en memoria
+            activos = _vista.listar(estados, limit)
+            if activos is not None:
+                return _json_pedidos(activos, etag)
+        pedidos = await _db(
+            _get_all_pedidos,
+            estados=estados,
+            modo=modo,
+            desde=desde,
+            hasta=hasta,
+            before_id=before_id,
+            after_id=after_id,
+            limit=limit,
+            archivados=archivados,
+        )
+        return _json_pedidos([_serializar_pedido(p) for p in pedidos], etag)
+    # Feed incremental: solo lo que cambió desde la revisión que ya tiene el cliente
+    revision, cambios = await _cambios_desde(since, _estados_para_feed(since, estados))
+    # La etiqueta va con la revisión que de verdad se mandó
+    return _json_pedidos({"revision": revision, "pedidos": cambios}, _etag_pedidos(request, revision))
+
+@app.get("/api/pedidos/stream")
+async def stream_pedidos(
+    request: Request,
+    since: int = Query(default=0, ge=0),
+    estado: Optional[List[str]] = Query(default=None),
+):
+    """Server-Sent Events con los pedidos creados o modificados.
+
+    Primero manda todo lo que cambió desde ``since`` y luego cada cambio en
+    cuanto ocurre. Cada evento trae el mismo formato que ``?since=``.
+    """
+    estados = _estados_para_feed(since, _normalizar_estados(estado))
+    # Suscribimos antes de leer la base para no perder cambios intermedios
+    q = _hub.subscribe()
+
+    async def eventos() -> AsyncIterator[str]:
+        try:
+            revision, cambios = await _cambios_desde(since, estados)
+            yield _sse("pedidos", {"revision": revision, "pedidos": cambios})
+            while True:
+                try:
+                    evento = await asyncio.wait_for(q.get(), STREAM_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # Comentario SSE para que los proxies no cierren la conexión
+                    yield ": ping\n\n"
+                    continue
+                if evento is None:
+                    break
+                if int(evento["revision"]) <= revision:
+                    continue  # ya iba incluido en la respuesta inicial
+                revision = int(evento["revision"])
+                yield _sse("pedidos", evento)
+        finally:
+            _hub.unsubscribe(q)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/api/pedidos/{pedido_id}")
 async def get_pedido(pedido_id: int):
-    pedido = _get_pedido(pedido_id)
-    if not pedido:
+    pedidos = await _pedidos_serializados([pedido_id])
+    if not pedidos:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
-    return _serializar_pedido(pedido)
+    return pedidos[0]
 
 @app.put("/api/pedidos/{pedido_id}/estado")
 async def update_estado_endpoint(pedido_id: int, data: PedidoEstado):
@@ -200,28 +2240,114 @@ async def update_estado_endpoint(pedido_id: int, data: PedidoEstado):
     if not nuevo_estado:
         raise HTTPException(status_code=400, detail="Estado inválido")
 
-    if not _update_estado(pedido_id, nuevo_estado):
+    if not await _db(_update_estado, pedido_id, nuevo_estado):
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
-    
-    pedido = _get_pedido(pedido_id)
-    return {"mensaje": "Estado actualizado", "estado": pedido["estado"]}
+    return {"mensaje": "Estado actualizado", "estado": nuevo_estado}
 
 @app.post("/api/pedidos/sync")
 async def sync_pedidos(payload: PedidosSync):
-    ids_map: Dict[str, int] = {}
-    print(f"🔄 Sincronizando {len(payload.pedidos)} pedidos offline")
-    for item in payload.pedidos:
-        pedido = Pedido(
-            productos=item.productos,
-            total=item.total,
-            estado=item.estado,
-            modo=item.modo,
-        )
-        new_id = _insert_pedido(pedido)
-        if item.temp_id:
-            ids_map[item.temp_id] = new_id
+    log.info("sincronizando pedidos offline", extra={"campos": {"pedidos": len(payload.pedidos)}})
+    # Validamos todo el lote antes de escribir: o entra completo o no entra nada
+    errores = _validar_lote(payload.pedidos)
+    if errores:
+        raise HTTPException(status_code=422, detail=errores)
+
+    ids, creados = await _db(_insert_pedidos, payload.pedidos)
+    ids_map: Dict[str, int] = {
+        item.temp_id: new_id
+        for item, new_id in zip(payload.pedidos, ids)
+        if item.temp_id
+    }
     return {"mensaje": "Pedidos sincronizados", "ids": ids_map}
 
+@app.get("/api/produccion")
+async def get_produccion():
+    """Lo pendiente agrupado por producto, con horas estimadas, para el barista."""
+    activos = _vista.listar(list(PRODUCCION_ESTADOS), None)
+    inicios = await _db(
+        _inicios_preparacion, [p["id"] for p in activos if p["estado"] == "preparando"]
+    )
+    return _cola_produccion(activos, inicios, datetime.now())
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    if not METRICAS_ACTIVAS:
+        raise HTTPException(status_code=404, detail="Métricas deshabilitadas")
+    lineas: List[str] = []
+    for metrica in _METRICAS:
+        lineas.extend(metrica.exponer())
+    return PlainTextResponse(
+        "\n".join(lineas) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
+
+# --- Administración del catálogo ---
+ADMIN_TOKEN = os.getenv("PIKO_ADMIN_TOKEN", "")
+
+def _verificar_admin(token: Optional[str]) -> None:
+    # Sin PIKO_ADMIN_TOKEN configurado los endpoints de admin quedan apagados
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Administración deshabilitada")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Token inválido")
+
+@app.put("/api/admin/productos")
+async def upsert_productos(
+    payload: CatalogoUpsert,
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    """Crea o actualiza productos y publica el nuevo catálogo sin reiniciar."""
+    _verificar_admin(x_admin_token)
+    if not payload.productos:
+        raise HTTPException(status_code=400, detail="Sin productos")
+    total = await _db(_guardar_productos, [p.model_dump() for p in payload.productos])
+    catalogo = await _db(_cargar_catalogo)
+    return {"mensaje": "Catálogo actualizado", "productos": total, "version": catalogo.version}
+
+@app.post("/api/admin/catalogo/recargar")
+async def recargar_catalogo(x_admin_token: Optional[str] = Header(default=None)):
+    """Vuelve a leer el catálogo de la base (p. ej. después de editarla a mano)."""
+    _verificar_admin(x_admin_token)
+    catalogo = await _db(_cargar_catalogo)
+    return {"mensaje": "Catálogo recargado", "productos": len(catalogo.por_id), "version": catalogo.version}
+
+@app.post("/api/admin/mantenimiento")
+async def correr_mantenimiento(
+    x_admin_token: Optional[str] = Header(default=None),
+    dias: float = Query(default=ARCHIVO_DIAS, ge=0),
+):
+    """Corre ya el archivo de confirmados y la compactación de la base."""
+    _verificar_admin(x_admin_token)
+    return await _db(_mantenimiento, dias)
+
+@app.get("/api/admin/reportes/ventas")
+async def reporte_ventas(
+    x_admin_token: Optional[str] = Header(default=None),
+    agrupar: str = Query(default="dia"),
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+):
+    """Ventas por hora, día, producto, sección, consumo o forma de pago.
+
+    El rango se redondea a horas completas: ``desde`` inclusivo, ``hasta``
+    exclusivo (una hora a medias entra completa).
+    """
+    _verificar_admin(x_admin_token)
+    if agrupar not in AGRUPACIONES_VENTAS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"agrupar debe ser uno de: {', '.join(AGRUPACIONES_VENTAS)}",
+        )
+    return await _db(
+        _reporte_ventas,
+        agrupar,
+        _hora_clave(desde) if desde else None,
+        _hora_clave(hasta, redondear_arriba=True) if hasta else None,
+    )
+
 # Instrucciones para correr:
 # pip install fastapi uvicorn
-# uvicorn backend:app --reload --port 9000
\ No newline at end of file
+# uvicorn backend:app --reload --port 9000
+# En producción conviene además --timeout-graceful-shutdown 10: si algo más
+# deja una conexión abierta, el apagado no se queda esperando para siempre.
\ No newline at end of file
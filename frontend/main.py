@@ -1,6 +1,16 @@
 import asyncio
+import atexit
+import functools
 import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
 import time
+import uuid
+from collections import deque
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 import os
@@ -14,11 +24,338 @@ API_BASE_URL = os.getenv("API_BASE_URL", "https://piko-backend-jo6r.onrender.com
 # TODOS los endpoints del backend están bajo /api
 API_URL = API_BASE_URL.rstrip("/") + "/api"
 
+# --- Logging ---
+# Igual que en el backend: los logs pasan por una cola y un hilo aparte los
+# escribe, para que un print lento no frene la UI. JSON o texto, con niveles.
+LOG_LEVEL = os.getenv("PIKO_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("PIKO_LOG_FORMAT", "json").lower()
+# Fracción de errores repetitivos (polling sin red) que se registran
+LOG_MUESTREO = float(os.getenv("PIKO_LOG_MUESTREO", "0.2"))
+
+class _ColaLogHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Como en el backend: el traceback va aparte en exc_text (el prepare
+        # de la stdlib lo pega al mensaje y borra exc_info)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def _texto_error(formato: logging.Formatter, record: logging.LogRecord) -> Optional[str]:
+    # Sin cola (pyodide) el registro llega con exc_info y sin exc_text
+    if record.exc_info and not record.exc_text:
+        record.exc_text = formato.formatException(record.exc_info)
+    return record.exc_text
+
+class _FormatoJson(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        evento: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        evento.update(getattr(record, "campos", None) or {})
+        error = _texto_error(self, record)
+        if error:
+            evento["error"] = error
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+class _FormatoTexto(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        campos = " ".join(f"{k}={v}" for k, v in (getattr(record, "campos", None) or {}).items())
+        linea = f"{self.formatTime(record)} {record.levelname:<7} {record.getMessage()}"
+        linea += f" {campos}" if campos else ""
+        error = _texto_error(self, record)
+        return linea + (f"\n{error}" if error else "")
+
+def _configurar_logging() -> logging.Logger:
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(_FormatoJson() if LOG_FORMAT == "json" else _FormatoTexto())
+    logger = logging.getLogger("piko.front")
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    if sys.platform == "emscripten":
+        # En el navegador (pyodide) no hay hilos: se escribe directo
+        logger.handlers[:] = [salida]
+        return logger
+    cola: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger.handlers[:] = [_ColaLogHandler(cola)]
+    listener = logging.handlers.QueueListener(cola, salida)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+log = _configurar_logging()
+
+def _muestrear(tasa: float) -> bool:
+    return tasa >= 1 or random.random() < tasa
+
+def _request_id(r: Any) -> Optional[str]:
+    # Sirve con un Response o con la excepción de httpx que trae el request
+    try:
+        return r.request.headers.get("X-Request-ID")
+    except (AttributeError, RuntimeError):
+        return None
+
+log.info("configuración", extra={"campos": {"api_url": API_URL}})
+
+# --- Instrumentación de rendimiento (PIKO_PERF=1) ---
+# Apagada no parchea nada: los decoradores regresan la función tal cual y
+# registrar() sale en la primera línea.
+PERF_ENABLED = os.getenv("PIKO_PERF", "0") == "1"
+PERF_DUMP_FILE = os.getenv("PIKO_PERF_DUMP")  # sin archivo, el resumen va al log
+PERF_DUMP_SECONDS = float(os.getenv("PIKO_PERF_DUMP_SECONDS", "30"))
+PERF_OVERLAY = os.getenv("PIKO_PERF_OVERLAY", "1") == "1"
+PERF_MUESTRAS = 200
+
+class _Perf:
+    """Tiempos (ms) y conteos por nombre: renders, requests, polling, updates."""
+
+    def __init__(self, activo: bool):
+        self.activo = activo
+        self.series: Dict[str, Dict[str, Any]] = {}
+        self.controles_creados = 0
+        self.en_overlay = False
+
+    def registrar(self, nombre: str, ms: float, **conteos: int) -> None:
+        if not self.activo:
+            return
+        serie = self.series.get(nombre)
+        if serie is None:
+            serie = self.series[nombre] = {
+                "n": 0, "total_ms": 0.0, "max_ms": 0.0, "ultimo_ms": 0.0,
+                "muestras": deque(maxlen=PERF_MUESTRAS), "conteos": {},
+            }
+        serie["n"] += 1
+        serie["total_ms"] += ms
+        serie["max_ms"] = max(serie["max_ms"], ms)
+        serie["ultimo_ms"] = ms
+        serie["muestras"].append(ms)
+        for clave, valor in conteos.items():
+            serie["conteos"][clave] = valor
+
+    def medido(self, nombre: str):
+        """Decorador para renders: tiempo y controles creados por llamada."""
+        def decorador(fn):
+            if not self.activo:
+                return fn
+
+            @functools.wraps(fn)
+            def envuelto(*args, **kwargs):
+                creados = self.controles_creados
+                inicio = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.registrar(
+                        nombre,
+                        (time.perf_counter() - inicio) * 1000,
+                        controles=self.controles_creados - creados,
+                    )
+            return envuelto
+        return decorador
+
+    def resumen(self) -> Dict[str, Dict[str, Any]]:
+        salida = {}
+        for nombre, serie in sorted(self.series.items()):
+            muestras = sorted(serie["muestras"])
+            salida[nombre] = {
+                "n": serie["n"],
+                "prom_ms": round(serie["total_ms"] / serie["n"], 2),
+                "p95_ms": round(muestras[min(len(muestras) - 1, int(len(muestras) * 0.95))], 2),
+                "max_ms": round(serie["max_ms"], 2),
+                "ultimo_ms": round(serie["ultimo_ms"], 2),
+                **serie["conteos"],
+            }
+        return salida
+
+perf = _Perf(PERF_ENABLED)
+
+def _instrumentar_flet() -> None:
+    """Cuenta controles creados y mide cada page.update (y su diff)."""
+    init_original = ft.Control.__init__
+
+    def init_contado(self, *args, **kwargs):
+        perf.controles_creados += 1
+        init_original(self, *args, **kwargs)
+
+    ft.Control.__init__ = init_contado
+
+    update_original = ft.Page.update
+
+    def update_medido(self, *controls):
+        inicio = time.perf_counter()
+        try:
+            return update_original(self, *controls)
+        finally:
+            if not perf.en_overlay:
+                perf.registrar("page.update", (time.perf_counter() - inicio) * 1000)
+
+    ft.Page.update = update_medido
+
+    # Tamaño del diff: cuántos comandos y controles nuevos/quitados manda el
+    # update. Es un método privado de Flet; si cambia, solo perdemos este dato.
+    preparar = getattr(ft.Page, "_Page__prepare_update", None)
+    if preparar is not None:
+        def preparar_medido(self, *controls):
+            commands, agregados, quitados = preparar(self, *controls)
+            if not perf.en_overlay:
+                perf.registrar(
+                    "page.update.diff", 0.0,
+                    comandos=len(commands), agregados=len(agregados), quitados=len(quitados),
+                )
+            return commands, agregados, quitados
+
+        ft.Page._Page__prepare_update = preparar_medido
+
+if PERF_ENABLED:
+    _instrumentar_flet()
+
+_RUTA_IDS = re.compile(r"/\d+(?=/|$)")
+
+async def _perf_request(request: httpx.Request) -> None:
+    request.extensions["piko_inicio"] = time.perf_counter()
+
+async def _perf_response(response: httpx.Response) -> None:
+    # Tiempo hasta tener los headers (el cuerpo de un stream no cuenta)
+    inicio = response.request.extensions.get("piko_inicio")
+    if inicio is not None:
+        ruta = _RUTA_IDS.sub("/{id}", response.request.url.path)
+        perf.registrar(
+            f"http {response.request.method} {ruta}",
+            (time.perf_counter() - inicio) * 1000,
+            status=response.status_code,
+        )
+
+_perf_volcado_activo = False
+
+async def _volcar_perf() -> None:
+    """Cada PERF_DUMP_SECONDS escribe el resumen (JSON) al archivo o al log."""
+    global _perf_volcado_activo
+    if _perf_volcado_activo:
+        return  # una sola tarea para todas las sesiones
+    _perf_volcado_activo = True
+    try:
+        while True:
+            await asyncio.sleep(PERF_DUMP_SECONDS)
+            resumen = perf.resumen()
+            if PERF_DUMP_FILE:
+                with open(PERF_DUMP_FILE, "w", encoding="utf-8") as f:
+                    json.dump(
+                        {"ts": datetime.now().isoformat(timespec="seconds"), "series": resumen},
+                        f, ensure_ascii=False, indent=2,
+                    )
+            else:
+                log.info("perf", extra={"campos": {"series": resumen}})
+    finally:
+        _perf_volcado_activo = False
 
-print(f"[Piko] Usando API_URL = {API_URL}")
+async def _refrescar_overlay(page: ft.Page, texto: ft.Text) -> None:
+    while True:
+        await asyncio.sleep(1)
+        lineas = []
+        for nombre, datos in perf.resumen().items():
+            extra = " ".join(
+                f"{k}={v}" for k, v in datos.items()
+                if k not in ("n", "prom_ms", "p95_ms", "max_ms", "ultimo_ms")
+            )
+            lineas.append(
+                f"{nombre}: {datos['ultimo_ms']:.1f}ms (p95 {datos['p95_ms']:.1f}) ×{datos['n']} {extra}"
+            )
+        texto.value = "\n".join(lineas) or "sin datos todavía"
+        perf.en_overlay = True
+        try:
+            texto.update()
+        except Exception:
+            return  # la sesión se cerró
+        finally:
+            perf.en_overlay = False
+
+def montar_perf(page: ft.Page) -> None:
+    """Arranca el volcado periódico y, si se pidió, el overlay de depuración."""
+    if not PERF_ENABLED:
+        return
+    page.run_task(_volcar_perf)
+    if not PERF_OVERLAY:
+        return
+    texto = ft.Text("", size=10, color="#a7f3d0", font_family="monospace", selectable=True)
+    page.overlay.append(
+        ft.Container(
+            content=texto,
+            bgcolor="#cc000000",
+            padding=6,
+            border_radius=6,
+            left=8,
+            bottom=8,
+        )
+    )
+    page.run_task(_refrescar_overlay, page, texto)
 
 POLL_SECONDS = 3
+# El stream de pedidos manda un ping cada 15 s; si no llega nada en este
+# tiempo damos la conexión por muerta y volvemos al polling
+STREAM_READ_TIMEOUT = 40
+STREAM_RETRY_MAX = 60
+# La lista de preparación del barista se refresca con cada cambio de pedidos
+# y, aparte, cada PRODUCCION_SECONDS para que avancen las horas estimadas
+PRODUCCION_SECONDS = 10
 PENDING_KEY = "piko_offline_pedidos"
+# Subida de pedidos offline: lotes de SYNC_CHUNK, hasta SYNC_CONCURRENCY a la
+# vez, y espera creciente (SYNC_BASE_SECONDS..SYNC_MAX_SECONDS) si no hay red
+SYNC_CHUNK = 25
+SYNC_CONCURRENCY = 3
+SYNC_BASE_SECONDS = 5
+SYNC_MAX_SECONDS = 120
+
+# --- Cliente HTTP compartido ---
+# Un solo AsyncClient para toda la app: las conexiones (TCP+TLS) al backend
+# se reutilizan entre llamadas en lugar de abrirse en cada request.
+HTTP_TIMEOUT = float(os.getenv("PIKO_HTTP_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("PIKO_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("PIKO_HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("PIKO_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("PIKO_HTTP2", "1") == "1"
+
+try:
+    import h2  # noqa: F401  (httpx lo necesita para HTTP/2)
+except ImportError:
+    HTTP2_ENABLED = False
+
+_api_client: Optional[httpx.AsyncClient] = None
+_sesiones_activas = 0
+
+def api_client() -> httpx.AsyncClient:
+    """Cliente HTTP de la app; se crea la primera vez que se necesita."""
+    global _api_client
+    if _api_client is None or _api_client.is_closed:
+        _api_client = httpx.AsyncClient(
+            trust_env=False,
+            http2=HTTP2_ENABLED,
+            timeout=HTTP_TIMEOUT,
+            event_hooks={
+                "request": [_poner_request_id, *([_perf_request] if PERF_ENABLED else [])],
+                "response": [_perf_response] if PERF_ENABLED else [],
+            },
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _api_client
+
+async def _poner_request_id(request: httpx.Request) -> None:
+    # El backend usa este id en sus logs: así se cruzan los de ambos lados
+    request.headers.setdefault("X-Request-ID", uuid.uuid4().hex[:12])
+
+async def cerrar_api_client():
+    global _api_client
+    client, _api_client = _api_client, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
 
 BG      = "#0b0f14"
 PANEL   = "#111827"
@@ -222,7 +559,8 @@ class AppState:
         self.menu = []
         self.carrito = []
         self.pedido_id = None
-        self.pedidos = []
+        # ETag de la última respuesta del menú (para GET condicional)
+        self.menu_etag = None
 
     def total(self) -> float:
         return sum(
@@ -235,68 +573,293 @@ class AppState:
 
 state = AppState()
 
+class FeedPedidos:
+    """Pedidos que sigue una vista, al día con el feed incremental.
+
+    Cada vista arma el suyo: con la app en modo web todas las sesiones
+    comparten el proceso (y ``state``), y el cursor o el filtro de una
+    pantalla no deben pisar los de otra.
+    """
+
+    def __init__(self, estados: tuple = ()):
+        self.pedidos = []
+        # Cursor del feed incremental de /api/pedidos (última revisión aplicada)
+        self.rev = 0
+        # Estados que muestra la vista; el backend filtra con ellos
+        self.estados = estados
+        # ETag de la última respuesta (para GET condicional)
+        self.etag = None
+
+    def params(self) -> dict:
+        return {"since": self.rev, "estado": list(self.estados)}
+
+    def aplicar(self, data: dict) -> bool:
+        """Mezcla en self.pedidos la respuesta de GET /pedidos?since=...
+
+        Regresa True si algo cambió (y hay que volver a dibujar).
+        """
+        revision = int(data.get("revision") or 0)
+        if revision < self.rev:
+            # El backend empezó con una base nueva: descartamos lo local y se
+            # vuelve a pedir todo desde cero en el siguiente ciclo
+            self.pedidos = []
+            self.rev = 0
+            return True
+
+        cambios = data.get("pedidos") or []
+        self.rev = revision
+        if not cambios:
+            return False
+
+        por_id = {p["id"]: p for p in self.pedidos}
+        cambio = False
+        for p in cambios:
+            if self.estados and p.get("estado") not in self.estados:
+                # Salió de lo que muestra la vista (p. ej. pasó a confirmado)
+                cambio |= por_id.pop(p["id"], None) is not None
+            else:
+                por_id[p["id"]] = p
+                cambio = True
+        if cambio:
+            self.pedidos = sorted(por_id.values(), key=lambda x: x["id"], reverse=True)
+        return cambio
+
+# --------------------- TAREAS DE LA VISTA ACTIVA --------------------- #
+# Flet no avisa cuando se reemplaza una vista, así que route_change detiene
+# a mano lo que la vista anterior dejó corriendo (polling, stream, etc.)
+_tareas_vista: dict = {}  # id(page) -> [(control_flag, futuro)]
+
+def tarea_de_vista(page: ft.Page, control_flag: list, handler, *args):
+    """Corre ``handler`` en segundo plano mientras la vista actual siga abierta."""
+    futuro = page.run_task(handler, *args)
+    _tareas_vista.setdefault(id(page), []).append((control_flag, futuro))
+    return futuro
+
+def detener_vista(page: ft.Page):
+    """Detiene las tareas de la vista que está por reemplazarse.
+
+    Además de bajar la bandera se cancela la tarea: así un stream abierto
+    se cierra de inmediato y libera su conexión del pool en lugar de
+    esperar al siguiente ping.
+    """
+    for control_flag, futuro in _tareas_vista.pop(id(page), []):
+        control_flag[0] = False
+        futuro.cancel()
+
+# --------------------- PEDIDOS EN VIVO (STREAM + POLLING) --------------------- #
+async def escuchar_stream_pedidos(render, control_flag, feed: FeedPedidos) -> bool:
+    """Aplica los eventos de /pedidos/stream hasta que la conexión se corte.
+
+    Regresa True si se llegó a conectar (para decidir cuándo reintentar).
+    """
+    conectado = False
+    try:
+        client = api_client()
+        async with client.stream(
+            "GET",
+            f"{API_URL}/pedidos/stream",
+            params=feed.params(),
+            timeout=httpx.Timeout(5, read=STREAM_READ_TIMEOUT),
+        ) as r:
+            if r.status_code != 200:
+                return False
+            conectado = True
+            async for line in r.aiter_lines():
+                if not control_flag[0]:
+                    break
+                if line.startswith("data:"):
+                    inicio = time.perf_counter()
+                    if feed.aplicar(json.loads(line[5:])):
+                        render()
+                    perf.registrar("stream.evento", (time.perf_counter() - inicio) * 1000)
+    except Exception as e:
+        log.warning("stream de pedidos cortado", extra={"campos": {
+            "error": repr(e), "request_id": _request_id(e),
+        }})
+    return conectado
+
+async def seguir_pedidos(render, control_flag, etiqueta: str, feed: FeedPedidos):
+    """Mantiene feed.pedidos al día mientras la vista siga abierta.
+
+    Solo se piden los pedidos en ``feed.estados``. Usa el stream en vivo y,
+    cuando no está disponible, hace polling cada POLL_SECONDS mientras
+    reintenta conectarse con espera creciente.
+    """
+    espera_stream = POLL_SECONDS
+    proximo_stream = 0.0
+    while control_flag[0]:
+        if time.monotonic() >= proximo_stream:
+            if await escuchar_stream_pedidos(render, control_flag, feed):
+                espera_stream = POLL_SECONDS
+            else:
+                espera_stream = min(espera_stream * 2, STREAM_RETRY_MAX)
+            proximo_stream = time.monotonic() + espera_stream
+            if not control_flag[0]:
+                break
+        try:
+            client = api_client()
+            headers = (
+                {"If-None-Match": feed.etag} if feed.etag else {}
+            )
+            inicio = time.perf_counter()
+            r = await client.get(
+                f"{API_URL}/pedidos",
+                params=feed.params(),
+                headers=headers,
+                timeout=5,
+            )
+            # 304: nada cambió desde la última consulta
+            if r.status_code == 200:
+                feed.etag = r.headers.get("etag")
+                if feed.aplicar(r.json()):
+                    render()
+            # Ida y vuelta completa: request, JSON y render si hubo cambios
+            perf.registrar(
+                f"poll.{etiqueta}", (time.perf_counter() - inicio) * 1000, status=r.status_code
+            )
+        except Exception as e:
+            # Sin red esto pasa cada POLL_SECONDS: solo registramos una muestra
+            if _muestrear(LOG_MUESTREO):
+                log.warning("error en polling", extra={"campos": {
+                    "vista": etiqueta, "error": repr(e), "muestreo": LOG_MUESTREO,
+                }})
+        try:
+            await asyncio.sleep(POLL_SECONDS)
+        except:
+            control_flag[0] = False
+
 # --------------------- LÓGICA OFFLINE/SYNC (HTTPX) --------------------- #
+def _llave_offline(order: dict) -> str:
+    return order.get("client_id") or order.get("temp_id")
+
+async def _leer_pendientes(page: ft.Page) -> list:
+    pending_json = await page.client_storage.get_async(PENDING_KEY)
+    return json.loads(pending_json) if pending_json else []
+
+async def _subir_lote(client: httpx.AsyncClient, lote: list) -> tuple:
+    """Sube un lote a /pedidos/sync. Regresa (llaves subidas, llaves a descartar).
+
+    Si el backend rechaza el lote por validación (422) se reintenta pedido
+    por pedido para aislar los inválidos, que se descartan porque nunca
+    van a entrar.
+    """
+    r = await client.post(
+        f"{API_URL}/pedidos/sync", json={"pedidos": lote}, timeout=10
+    )
+    if r.status_code == 200:
+        return [_llave_offline(o) for o in lote], []
+    if r.status_code == 422 and len(lote) > 1:
+        subidos, descartados = [], []
+        for order in lote:
+            ok, malos = await _subir_lote(client, [order])
+            subidos.extend(ok)
+            descartados.extend(malos)
+        return subidos, descartados
+    if r.status_code == 422:
+        log.warning("pedido offline inválido, se descarta", extra={"campos": {
+            "llave": _llave_offline(lote[0]), "detalle": r.text, "request_id": _request_id(r),
+        }})
+        return [], [_llave_offline(lote[0])]
+    raise Exception(f"Error del servidor: {r.status_code}")
+
 async def sync_offline_orders(page: ft.Page):
-    PENDING_KEY = "piko_offline_pedidos"
-    print("--- 📡 Servicio de Sincronización Iniciado ---")
+    log.info("servicio de sincronización iniciado")
+    fallos = 0
     while True:
+        espera = SYNC_BASE_SECONDS
         try:
-            pending_json = await page.client_storage.get_async(PENDING_KEY)
-            pending_orders = json.loads(pending_json) if pending_json else []
-
+            pending_orders = await _leer_pendientes(page)
             if pending_orders:
-                still_pending = []
-                synced_count = 0
+                # Pedidos guardados antes de tener llave: les damos una y la
+                # persistimos para que los reintentos sean idempotentes
+                if any(not _llave_offline(o) for o in pending_orders):
+                    for o in pending_orders:
+                        if not _llave_offline(o):
+                            o["client_id"] = o["temp_id"] = str(uuid.uuid4())
+                    await page.client_storage.set_async(
+                        PENDING_KEY, json.dumps(pending_orders)
+                    )
 
-                # CAMBIO: Usamos httpx async
-                async with httpx.AsyncClient(trust_env=False) as client:
-                    for order in pending_orders:
-                        try:
-                            r = await client.post(
-                                f"{API_URL}/pedidos",
-                                json=order,
-                                timeout=5,
-                            )
-                            if r.status_code == 200:
-                                synced_count += 1
-                                print(
-                                    f"✅ Pedido sincronizado: {order.get('modo')}"
-                                )
-                                page.snack_bar = ft.SnackBar(
-                                    ft.Text(
-                                        "¡Conexión recuperada! Pedido subido."
-                                    ),
-                                    bgcolor=GREEN,
-                                )
-                                page.snack_bar.open = True
-                                page.update()
-                            else:
-                                still_pending.append(order)
-                        except Exception as e:
-                            print("Error al sincronizar pedido:", e)
-                            still_pending.append(order)
+                lotes = [
+                    pending_orders[i:i + SYNC_CHUNK]
+                    for i in range(0, len(pending_orders), SYNC_CHUNK)
+                ]
+                limite = asyncio.Semaphore(SYNC_CONCURRENCY)
 
-                if synced_count > 0:
+                async def subir(client, lote):
+                    async with limite:
+                        return await _subir_lote(client, lote)
+
+                client = api_client()
+                resultados = await asyncio.gather(
+                    *(subir(client, lote) for lote in lotes),
+                    return_exceptions=True,
+                )
+
+                listos = set()
+                synced_count = 0
+                errores = []
+                for res in resultados:
+                    if isinstance(res, Exception):
+                        errores.append(res)
+                        continue
+                    subidos, descartados = res
+                    synced_count += len(subidos)
+                    listos.update(subidos)
+                    listos.update(descartados)
+
+                if listos:
+                    # Releemos por si se guardó otro pedido mientras subíamos
+                    actuales = await _leer_pendientes(page)
                     await page.client_storage.set_async(
-                        PENDING_KEY, json.dumps(still_pending)
+                        PENDING_KEY,
+                        json.dumps(
+                            [o for o in actuales if _llave_offline(o) not in listos]
+                        ),
                     )
-        except Exception as e:
-            print("Error en sync_offline_orders:", e)
-        await asyncio.sleep(5)
+
+                if synced_count > 0:
+                    log.info("pedidos offline sincronizados", extra={"campos": {
+                        "pedidos": synced_count, "lotes": len(lotes),
+                    }})
+                    page.snack_bar = ft.SnackBar(
+                        ft.Text(
+                            f"¡Conexión recuperada! {synced_count} pedido(s) subidos."
+                        ),
+                        bgcolor=GREEN,
+                    )
+                    page.snack_bar.open = True
+                    page.update()
+
+                if errores:
+                    log.warning("error al sincronizar pedidos", extra={"campos": {
+                        "error": repr(errores[0]), "lotes_fallidos": len(errores), "fallos": fallos + 1,
+                    }})
+                    fallos += 1
+                    # Backoff exponencial con jitter para no martillar al
+                    # backend (ni la batería) mientras no haya red
+                    tope = min(SYNC_MAX_SECONDS, SYNC_BASE_SECONDS * 2 ** fallos)
+                    espera = random.uniform(SYNC_BASE_SECONDS, tope)
+                else:
+                    fallos = 0
+        except Exception:
+            log.exception("error en sync_offline_orders")
+        await asyncio.sleep(espera)
 
 async def save_order_offline(page: ft.Page, payload):
-    PENDING_KEY = "piko_offline_pedidos"
     try:
         existing_json = await page.client_storage.get_async(PENDING_KEY)
         current_list = json.loads(existing_json) if existing_json else []
         payload["modo"] = f"{payload['modo']} (OFFLINE)"
+        payload.setdefault("client_id", str(uuid.uuid4()))
+        payload["temp_id"] = payload["client_id"]
         current_list.append(payload)
         await page.client_storage.set_async(
             PENDING_KEY, json.dumps(current_list)
         )
         return True
     except Exception as e:
-        print(f"Error guardando offline: {e}")
+        log.error("error guardando offline", extra={"campos": {"error": repr(e)}})
         return False
 
 # --------------------- VISTAS (TU DISEÑO EXACTO) --------------------- #
@@ -476,6 +1039,7 @@ def MenuView(page: ft.Page):
         render_cart()
         update_total()
 
+    @perf.medido("render.cart")
     def render_cart():
         cart_col.controls.clear()
         if not state.carrito:
@@ -569,8 +1133,9 @@ def MenuView(page: ft.Page):
                 )
         page.update()
 
+    @perf.medido("render.menu")
     def render_menu():
-        print("[Piko] Cargando menú en UI...")
+        log.debug("pintando menú", extra={"campos": {"productos": len(state.menu)}})
         menu_grid.controls.clear()
         sections = {}
         for p in state.menu:
@@ -803,14 +1368,28 @@ def MenuView(page: ft.Page):
     # CAMBIO: Carga asíncrona del menú
     async def init_menu():
         try:
-            print(f"[Piko] GET {API_URL}/menu")
-            async with httpx.AsyncClient(trust_env=False) as client:
-                r = await client.get(f"{API_URL}/menu", timeout=5)
-                print("[Piko] Respuesta menú:", r.status_code)
+            client = api_client()
+            inicio = time.perf_counter()
+            # Si ya tenemos el menú, el backend contesta 304 sin mandarlo otra vez
+            headers = (
+                {"If-None-Match": state.menu_etag}
+                if state.menu_etag and state.menu
+                else {}
+            )
+            r = await client.get(f"{API_URL}/menu", headers=headers, timeout=5)
+            log.info("menú cargado", extra={"campos": {
+                "status": r.status_code,
+                "ms": round((time.perf_counter() - inicio) * 1000, 1),
+                "request_id": _request_id(r),
+            }})
+            if r.status_code != 304:
                 state.menu = r.json()
-                render_menu()
+                state.menu_etag = r.headers.get("etag")
+            render_menu()
         except Exception as e:
-            print("Error cargando menú:", e)
+            log.warning("error cargando menú", extra={"campos": {
+                "error": repr(e), "request_id": _request_id(e),
+            }})
             menu_grid.controls.append(
                 ft.Text("Cargando o sin conexión...", color=MUTED)
             )
@@ -898,42 +1477,53 @@ def CheckoutView(page: ft.Page):
             "estado": "pendiente",
             "modo": f"{current_mode['label']} - {metodo}",
             "fecha_local": str(datetime.now()),
+            # Llave de idempotencia: si el backend ya guardó este pedido (p. ej.
+            # se cortó la respuesta), reenviarlo no crea un ticket repetido
+            "client_id": str(uuid.uuid4()),
         }
 
         try:
-            print("[Piko] Intentando enviar pedido...")
-            async with httpx.AsyncClient(trust_env=False) as client:
-                r = await client.post(
-                    f"{API_URL}/pedidos", json=payload, timeout=2
+            client = api_client()
+            inicio = time.perf_counter()
+            r = await client.post(
+                f"{API_URL}/pedidos", json=payload, timeout=2
+            )
+            log.info("pedido enviado", extra={"campos": {
+                "status": r.status_code,
+                "ms": round((time.perf_counter() - inicio) * 1000, 1),
+                "client_id": payload["client_id"],
+                "request_id": _request_id(r),
+            }})
+            page.close(loading)
+            if r.status_code == 200:
+                dlg_success = ft.AlertDialog(
+                    modal=True,
+                    title=ft.Text(
+                        "¡Pedido Enviado! 👨‍🍳",
+                        color=GREEN,
+                        text_align="center",
+                    ),
+                    content=ft.Icon(
+                        "check_circle", color=GREEN, size=60
+                    ),
+                    actions=[
+                        ft.TextButton(
+                            "Aceptar",
+                            on_click=lambda e: ir_inicio(dlg_success),
+                        )
+                    ],
+                )
+                page.open(dlg_success)
+                page.update()
+            else:
+                raise Exception(
+                    f"Error del servidor: {r.status_code}"
                 )
-                page.close(loading)
-                if r.status_code == 200:
-                    dlg_success = ft.AlertDialog(
-                        modal=True,
-                        title=ft.Text(
-                            "¡Pedido Enviado! 👨‍🍳",
-                            color=GREEN,
-                            text_align="center",
-                        ),
-                        content=ft.Icon(
-                            "check_circle", color=GREEN, size=60
-                        ),
-                        actions=[
-                            ft.TextButton(
-                                "Aceptar",
-                                on_click=lambda e: ir_inicio(dlg_success),
-                            )
-                        ],
-                    )
-                    page.open(dlg_success)
-                    page.update()
-                else:
-                    raise Exception(
-                        f"Error del servidor: {r.status_code}"
-                    )
 
         except Exception as e:
-            print(f"⚠️ Guardando localmente: {e}")
+            log.warning("pedido no enviado, se guarda localmente", extra={"campos": {
+                "error": repr(e), "client_id": payload["client_id"], "request_id": _request_id(e),
+            }})
             page.close(loading)
             try:
                 success = await save_order_offline(page, payload)
@@ -984,8 +1574,8 @@ def CheckoutView(page: ft.Page):
                     )
                     page.snack_bar.open = True
                     page.update()
-            except Exception as e2:
-                print("Error crítico al guardar offline:", e2)
+            except Exception:
+                log.exception("error crítico al guardar offline")
 
     # Botones de pago usando run_task
     def btn_pago(txt, icon, col, metodo_clave):
@@ -1081,6 +1671,8 @@ def BaristaView(page: ft.Page):
     pad = adaptive_padding(page)
 
     TABLE_HEADER_BG, ROW_BG = "#1f2937", "#111827"
+    # Pedidos que sigue esta vista (propios de la sesión, no del proceso)
+    feed = FeedPedidos(("pendiente", "preparando", "listo"))
 
     try:
         from plyer import notification
@@ -1135,20 +1727,22 @@ def BaristaView(page: ft.Page):
 
     async def update_est(pid, est):
         try:
-            async with httpx.AsyncClient(trust_env=False) as client:
-                r = await client.put(
-                    f"{API_URL}/pedidos/{pid}/estado",
-                    json={"estado": est},
-                    timeout=5,
-                )
-                if r.status_code == 200:
-                    for p in state.pedidos:
-                        if p["id"] == pid:
-                            p["estado"] = est
-                    render()
-                    return True
+            client = api_client()
+            r = await client.put(
+                f"{API_URL}/pedidos/{pid}/estado",
+                json={"estado": est},
+                timeout=5,
+            )
+            if r.status_code == 200:
+                for p in feed.pedidos:
+                    if p["id"] == pid:
+                        p["estado"] = est
+                render()
+                return True
         except Exception as e:
-            print("Error actualizando estado:", e)
+            log.warning("error actualizando estado", extra={"campos": {
+                "pedido_id": pid, "estado": est, "error": repr(e), "request_id": _request_id(e),
+            }})
         return False
 
     async def do_confirm(pid):
@@ -1253,199 +1847,368 @@ def BaristaView(page: ft.Page):
             [btn_prep, btn_listo], spacing=10, expand=is_mobile
         )
 
-    def render():
-        orders_column.controls.clear()
-        try:
-            filtrados = [
-                p for p in state.pedidos if p.get("estado") != "confirmado"
-            ]
-        except:
-            filtrados = []
+    def build_header_row():
+        return ft.Container(
+            bgcolor=TABLE_HEADER_BG,
+            padding=ft.padding.all(15),
+            border_radius=ft.border_radius.only(
+                top_left=10, top_right=10
+            ),
+            content=ft.Row(
+                [
+                    ft.Text(
+                        "ID",
+                        width=50,
+                        color=MUTED,
+                        weight="bold",
+                    ),
+                    ft.Text(
+                        "Productos",
+                        expand=True,
+                        color=MUTED,
+                        weight="bold",
+                    ),
+                    ft.Text(
+                        "Total",
+                        width=80,
+                        color=MUTED,
+                        weight="bold",
+                    ),
+                    ft.Text(
+                        "Estado",
+                        width=100,
+                        color=MUTED,
+                        weight="bold",
+                    ),
+                    ft.Text(
+                        "Acciones",
+                        width=160,
+                        color=MUTED,
+                        weight="bold",
+                        text_align="center",
+                    ),
+                ],
+                alignment="spaceBetween",
+            ),
+        )
 
-        is_mobile = page.width < 650
+    def build_empty_row():
+        return ft.Container(
+            ft.Text(
+                "No hay pedidos pendientes",
+                italic=True,
+                color=MUTED,
+            ),
+            padding=40,
+            alignment=ft.alignment.center,
+            bgcolor=ROW_BG,
+        )
 
-        if not is_mobile:
-            header_row = ft.Container(
-                bgcolor=TABLE_HEADER_BG,
-                padding=ft.padding.all(15),
-                border_radius=ft.border_radius.only(
-                    top_left=10, top_right=10
-                ),
-                content=ft.Row(
+    def build_row(p, pid, est, prods_str, is_mobile):
+        if is_mobile:
+            return ft.Container(
+                bgcolor=ROW_BG,
+                padding=15,
+                border_radius=12,
+                border=ft.border.all(1, "#374151"),
+                content=ft.Column(
                     [
-                        ft.Text(
-                            "ID",
-                            width=50,
-                            color=MUTED,
-                            weight="bold",
+                        ft.Row(
+                            [
+                                ft.Text(
+                                    f"#{str(pid).zfill(3)}",
+                                    size=20,
+                                    weight="bold",
+                                    color=WHITE,
+                                ),
+                                tag_chip(est, state_color(est)),
+                            ],
+                            alignment="spaceBetween",
                         ),
+                        ft.Divider(color="#374151", height=5),
                         ft.Text(
-                            "Productos",
-                            expand=True,
-                            color=MUTED,
-                            weight="bold",
+                            prods_str,
+                            color=WHITE,
+                            weight="500",
+                            size=16,
                         ),
                         ft.Text(
-                            "Total",
-                            width=80,
+                            p.get("modo", ""),
+                            size=12,
                             color=MUTED,
-                            weight="bold",
                         ),
-                        ft.Text(
-                            "Estado",
-                            width=100,
-                            color=MUTED,
-                            weight="bold",
+                        ft.Divider(color="#374151", height=5),
+                        ft.Row(
+                            [
+                                ft.Text(
+                                    money(p["total"]),
+                                    size=16,
+                                    weight="bold",
+                                    color=BLUE600,
+                                )
+                            ]
                         ),
-                        ft.Text(
-                            "Acciones",
-                            width=160,
-                            color=MUTED,
-                            weight="bold",
-                            text_align="center",
+                        ft.Container(
+                            get_action_buttons(pid, est, True),
+                            padding=ft.padding.only(top=5),
                         ),
-                    ],
-                    alignment="spaceBetween",
+                    ]
                 ),
             )
-            orders_column.controls.append(header_row)
-
-        if not filtrados:
-            orders_column.controls.append(
-                ft.Container(
+        return ft.Container(
+            bgcolor=ROW_BG,
+            padding=ft.padding.symmetric(
+                horizontal=15, vertical=20
+            ),
+            border=ft.border.only(
+                bottom=ft.BorderSide(1, "#374151")
+            ),
+            content=ft.Row(
+                [
                     ft.Text(
-                        "No hay pedidos pendientes",
-                        italic=True,
-                        color=MUTED,
+                        f"{str(pid).zfill(3)}",
+                        width=50,
+                        weight="bold",
+                        size=16,
                     ),
-                    padding=40,
-                    alignment=ft.alignment.center,
-                    bgcolor=ROW_BG,
-                )
-            )
+                    ft.Column(
+                        [
+                            ft.Text(
+                                prods_str,
+                                color=WHITE,
+                                weight="500",
+                                size=14,
+                                max_lines=2,
+                                overflow="ellipsis",
+                            ),
+                            ft.Text(
+                                p.get("modo", ""),
+                                size=12,
+                                color=MUTED,
+                            ),
+                        ],
+                        spacing=2,
+                        expand=True,
+                    ),
+                    ft.Text(
+                        money(p["total"]),
+                        width=80,
+                        size=14,
+                    ),
+                    ft.Container(
+                        tag_chip(est, state_color(est)),
+                        width=100,
+                        alignment=ft.alignment.center_left,
+                    ),
+                    ft.Container(
+                        get_action_buttons(pid, est, False),
+                        width=160,
+                        alignment=ft.alignment.center,
+                    ),
+                ],
+                alignment="spaceBetween",
+                vertical_alignment="center",
+            ),
+        )
 
+    # Cache de renglones por pedido: solo se reconstruye el renglón cuyo
+    # contenido o layout cambió; los demás se reutilizan tal cual
+    row_cache = {}  # pid -> (firma, control)
+    fijos = {}  # controles que no dependen de los pedidos
+
+    @perf.medido("render.barista")
+    def render():
+        try:
+            filtrados = [
+                p for p in feed.pedidos if p.get("estado") != "confirmado"
+            ]
+        except:
+            filtrados = []
+
+        is_mobile = page.width < 650
+        nuevos = []
+
+        if not is_mobile:
+            if "header" not in fijos:
+                fijos["header"] = build_header_row()
+            nuevos.append(fijos["header"])
+
+        if not filtrados:
+            if "vacio" not in fijos:
+                fijos["vacio"] = build_empty_row()
+            nuevos.append(fijos["vacio"])
+
+        vigentes = {}
         for p in sorted(filtrados, key=lambda x: x["id"]):
             pid = p["id"]
             est = p.get("estado", "pendiente").lower()
             prods_str = ", ".join(p.get("productos_nombres", []))
-
-            if is_mobile:
-                orders_column.controls.append(
-                    ft.Container(
-                        bgcolor=ROW_BG,
-                        padding=15,
-                        border_radius=12,
-                        border=ft.border.all(1, "#374151"),
-                        content=ft.Column(
-                            [
-                                ft.Row(
-                                    [
-                                        ft.Text(
-                                            f"#{str(pid).zfill(3)}",
-                                            size=20,
-                                            weight="bold",
-                                            color=WHITE,
-                                        ),
-                                        tag_chip(est, state_color(est)),
-                                    ],
-                                    alignment="spaceBetween",
-                                ),
-                                ft.Divider(color="#374151", height=5),
-                                ft.Text(
-                                    prods_str,
-                                    color=WHITE,
-                                    weight="500",
-                                    size=16,
-                                ),
-                                ft.Text(
-                                    p.get("modo", ""),
-                                    size=12,
-                                    color=MUTED,
-                                ),
-                                ft.Divider(color="#374151", height=5),
-                                ft.Row(
-                                    [
-                                        ft.Text(
-                                            money(p["total"]),
-                                            size=16,
-                                            weight="bold",
-                                            color=BLUE600,
-                                        )
-                                    ]
-                                ),
-                                ft.Container(
-                                    get_action_buttons(pid, est, True),
-                                    padding=ft.padding.only(top=5),
-                                ),
-                            ]
-                        ),
-                    )
-                )
+            firma = (est, is_mobile, prods_str, p.get("modo"), p.get("total"))
+            cached = row_cache.get(pid)
+            if cached and cached[0] == firma:
+                row = cached[1]
             else:
-                orders_column.controls.append(
-                    ft.Container(
-                        bgcolor=ROW_BG,
-                        padding=ft.padding.symmetric(
-                            horizontal=15, vertical=20
-                        ),
-                        border=ft.border.only(
-                            bottom=ft.BorderSide(1, "#374151")
-                        ),
-                        content=ft.Row(
-                            [
-                                ft.Text(
-                                    f"{str(pid).zfill(3)}",
-                                    width=50,
-                                    weight="bold",
-                                    size=16,
-                                ),
-                                ft.Column(
-                                    [
-                                        ft.Text(
-                                            prods_str,
-                                            color=WHITE,
-                                            weight="500",
-                                            size=14,
-                                            max_lines=2,
-                                            overflow="ellipsis",
-                                        ),
-                                        ft.Text(
-                                            p.get("modo", ""),
-                                            size=12,
-                                            color=MUTED,
-                                        ),
-                                    ],
-                                    spacing=2,
-                                    expand=True,
-                                ),
-                                ft.Text(
-                                    money(p["total"]),
-                                    width=80,
-                                    size=14,
-                                ),
-                                ft.Container(
-                                    tag_chip(est, state_color(est)),
-                                    width=100,
-                                    alignment=ft.alignment.center_left,
-                                ),
-                                ft.Container(
-                                    get_action_buttons(pid, est, False),
-                                    width=160,
-                                    alignment=ft.alignment.center,
-                                ),
-                            ],
-                            alignment="spaceBetween",
-                            vertical_alignment="center",
-                        ),
-                    )
-                )
+                row = build_row(p, pid, est, prods_str, is_mobile)
+            vigentes[pid] = (firma, row)
+            nuevos.append(row)
+        row_cache.clear()
+        row_cache.update(vigentes)
+
+        actuales = orders_column.controls
+        if len(nuevos) == len(actuales) and all(
+            a is b for a, b in zip(nuevos, actuales)
+        ):
+            return  # nada cambió: no mandamos nada por el websocket
+        orders_column.controls = nuevos
+        page.update()
+        # Cambiaron los pedidos: la cola de producción también (solo si la
+        # vista sigue abierta; un render tardío no debe volver a pedirla)
+        if control_flag[0]:
+            page.run_task(cargar_produccion)
+
+    # --- Lista de preparación: lo pendiente agrupado por producto ---
+    produccion = {"generado": None, "lotes": []}
+    lote_cache = {}  # producto_id -> (firma, control)
+    prep_column = ft.Column(spacing=8)
+
+    def minutos_restantes(lote):
+        try:
+            faltan = (
+                datetime.fromisoformat(lote["listo_estimado"])
+                - datetime.fromisoformat(produccion["generado"])
+            ).total_seconds()
+        except:
+            return ""
+        # Relativo a la hora del backend, así no importa el reloj del equipo
+        minutos = round(faltan / 60)
+        return "Ya" if minutos <= 0 else f"~{minutos} min"
+
+    def build_lote(lote, eta, is_mobile):
+        pedidos_str = ", ".join(
+            f"#{str(x['id']).zfill(3)}"
+            + (f" ({x['cantidad']})" if x["cantidad"] > 1 else "")
+            for x in lote["pedidos"]
+        )
+        en_prep = lote.get("en_preparacion", 0)
+        return ft.Container(
+            bgcolor=ROW_BG,
+            padding=ft.padding.symmetric(
+                horizontal=15, vertical=12 if is_mobile else 15
+            ),
+            border_radius=10,
+            border=ft.border.all(1, "#374151"),
+            content=ft.Row(
+                [
+                    ft.Text(
+                        f"{lote['cantidad']}×",
+                        width=60,
+                        size=22,
+                        weight="bold",
+                        color=WHITE,
+                    ),
+                    ft.Column(
+                        [
+                            ft.Text(
+                                lote["nombre"],
+                                color=WHITE,
+                                weight="bold",
+                                size=16,
+                            ),
+                            ft.Text(
+                                pedidos_str,
+                                size=12,
+                                color=MUTED,
+                                max_lines=2,
+                                overflow="ellipsis",
+                            ),
+                        ],
+                        spacing=2,
+                        expand=True,
+                    ),
+                    ft.Column(
+                        [
+                            tag_chip(
+                                f"{en_prep} preparando" if en_prep else "pendiente",
+                                state_color("preparando" if en_prep else "pendiente"),
+                            ),
+                            ft.Text(eta, size=12, color=MUTED),
+                        ],
+                        spacing=4,
+                        horizontal_alignment="end",
+                    ),
+                ],
+                vertical_alignment="center",
+            ),
+        )
 
+    @perf.medido("render.produccion")
+    def render_produccion():
+        is_mobile = page.width < 650
+        nuevos = []
+        vigentes = {}
+        for lote in produccion["lotes"]:
+            eta = minutos_restantes(lote)
+            firma = (
+                lote["cantidad"],
+                lote.get("en_preparacion", 0),
+                tuple((x["id"], x["cantidad"]) for x in lote["pedidos"]),
+                eta,
+                is_mobile,
+            )
+            cached = lote_cache.get(lote["producto_id"])
+            if cached and cached[0] == firma:
+                row = cached[1]
+            else:
+                row = build_lote(lote, eta, is_mobile)
+            vigentes[lote["producto_id"]] = (firma, row)
+            nuevos.append(row)
+        lote_cache.clear()
+        lote_cache.update(vigentes)
+
+        actuales = prep_column.controls
+        if (
+            prep_panel.visible == bool(nuevos)
+            and len(nuevos) == len(actuales)
+            and all(a is b for a, b in zip(nuevos, actuales))
+        ):
+            return
+        prep_column.controls = nuevos
+        prep_panel.visible = bool(nuevos)
         page.update()
 
+    async def cargar_produccion():
+        try:
+            client = api_client()
+            inicio = time.perf_counter()
+            r = await client.get(f"{API_URL}/produccion", timeout=5)
+            if r.status_code == 200:
+                produccion.update(r.json())
+                render_produccion()
+            perf.registrar(
+                "poll.produccion", (time.perf_counter() - inicio) * 1000, status=r.status_code
+            )
+        except Exception as e:
+            if _muestrear(LOG_MUESTREO):
+                log.warning("error leyendo la cola de producción", extra={"campos": {
+                    "error": repr(e), "request_id": _request_id(e), "muestreo": LOG_MUESTREO,
+                }})
+
+    async def seguir_produccion():
+        while control_flag[0]:
+            await cargar_produccion()
+            try:
+                await asyncio.sleep(PRODUCCION_SECONDS)
+            except:
+                control_flag[0] = False
+
     def on_resize(e):
+        # page.on_resized sobrevive al cambio de vista
+        if not control_flag[0]:
+            return
         render()
+        render_produccion()
 
-    page.on_resize = on_resize
+    page.on_resized = on_resize
 
     main_container = ft.Container(
         bgcolor=BG if page.width < 650 else ROW_BG,
@@ -1484,6 +2247,40 @@ def BaristaView(page: ft.Page):
         ),
     )
 
+    prep_panel = ft.Container(
+        visible=False,
+        bgcolor=BG if page.width < 650 else ROW_BG,
+        border=(
+            ft.border.all(1, "#374151")
+            if page.width > 650
+            else None
+        ),
+        border_radius=12,
+        padding=ft.padding.all(20) if page.width > 650 else 0,
+        content=ft.Column(
+            [
+                ft.Row(
+                    [
+                        ft.Text(
+                            "Lista de preparación",
+                            size=18,
+                            weight="bold",
+                        ),
+                        ft.Container(
+                            ft.Text("Por producto", size=12),
+                            bgcolor="#374151",
+                            padding=ft.padding.symmetric(4, 8),
+                            border_radius=10,
+                        ),
+                    ],
+                    alignment="spaceBetween",
+                ),
+                prep_column,
+            ],
+            spacing=10,
+        ),
+    )
+
     page.views.append(
         ft.View(
             route="/barista",
@@ -1491,7 +2288,7 @@ def BaristaView(page: ft.Page):
             controls=[
                 ft.Container(
                     content=ft.Column(
-                        [header, main_container], spacing=10
+                        [header, prep_panel, main_container], spacing=10
                     ),
                     padding=pad,
                     expand=True,
@@ -1503,23 +2300,18 @@ def BaristaView(page: ft.Page):
 
     control_flag = [True]
 
-    async def poll():
-        while control_flag[0]:
-            try:
-                async with httpx.AsyncClient(trust_env=False) as client:
-                    r = await client.get(f"{API_URL}/pedidos", timeout=5)
-                    if r.status_code == 200:
-                        state.pedidos = r.json()
-                        render()
-            except Exception as e:
-                print("Error poll barista:", e)
-            try:
-                await asyncio.sleep(POLL_SECONDS)
-            except:
-                control_flag[0] = False
-
-    page.run_task(poll)
-    page.views[-1].on_dispose = lambda e: control_flag.__setitem__(0, False)
+    # Dibujamos lo que ya tenemos; después solo se redibuja cuando hay cambios
+    render()
+    tarea_de_vista(
+        page,
+        control_flag,
+        seguir_pedidos,
+        render,
+        control_flag,
+        "barista",
+        feed,
+    )
+    tarea_de_vista(page, control_flag, seguir_produccion)
 
 # --- VISTA: PANTALLA ---
 def PantallaView(page: ft.Page):
@@ -1528,119 +2320,161 @@ def PantallaView(page: ft.Page):
     pad = adaptive_padding(page)
 
     COL_HEADER_BG, ROW_BG = "#1f2937", "#111827"
+    # Pedidos que sigue esta vista (propios de la sesión, no del proceso)
+    feed = FeedPedidos(("preparando", "listo"))
     col_p = ft.Column(spacing=10, expand=False)
     col_l = ft.Column(spacing=10, expand=False)
 
-    def render():
-        col_p.controls.clear()
-        col_l.controls.clear()
-        try:
-            pp = [
-                p
-                for p in state.pedidos
-                if p.get("estado") == "preparando"
-            ]
-            pl = [p for p in state.pedidos if p.get("estado") == "listo"]
-        except:
-            pp = []
-            pl = []
-
-        if not pp:
-            col_p.controls.append(
-                ft.Container(
+    def build_tile_preparando(p):
+        return ft.Container(
+            bgcolor=ROW_BG,
+            padding=15,
+            border_radius=8,
+            border=ft.border.only(
+                left=ft.BorderSide(5, BLUE600)
+            ),
+            animate_opacity=400,
+            content=ft.Row(
+                [
                     ft.Text(
-                        "Todo tranquilo...",
-                        color=MUTED,
-                        italic=True,
-                    ),
-                    padding=20,
-                )
-            )
-        for p in sorted(pp, key=lambda x: x["id"]):
-            col_p.controls.append(
-                ft.Container(
-                    bgcolor=ROW_BG,
-                    padding=15,
-                    border_radius=8,
-                    border=ft.border.only(
-                        left=ft.BorderSide(5, BLUE600)
+                        f"#{str(p['id']).zfill(3)}",
+                        size=28,
+                        weight="bold",
+                        color=WHITE,
                     ),
-                    content=ft.Row(
+                    ft.Column(
                         [
                             ft.Text(
-                                f"#{str(p['id']).zfill(3)}",
-                                size=28,
+                                "Preparando...",
+                                color=BLUE600,
                                 weight="bold",
-                                color=WHITE,
                             ),
-                            ft.Column(
-                                [
-                                    ft.Text(
-                                        "Preparando...",
-                                        color=BLUE600,
-                                        weight="bold",
-                                    ),
-                                    ft.Text(
-                                        p.get("modo", ""),
-                                        color=MUTED,
-                                        size=12,
-                                    ),
-                                ]
+                            ft.Text(
+                                p.get("modo", ""),
+                                color=MUTED,
+                                size=12,
                             ),
-                        ],
-                        alignment="spaceBetween",
+                        ]
                     ),
-                )
-            )
+                ],
+                alignment="spaceBetween",
+            ),
+        )
 
-        if not pl:
-            col_l.controls.append(
-                ft.Container(
+    def build_tile_listo(p):
+        return ft.Container(
+            bgcolor=ROW_BG,
+            padding=15,
+            border_radius=8,
+            border=ft.border.only(
+                left=ft.BorderSide(5, GREEN)
+            ),
+            animate_opacity=400,
+            content=ft.Row(
+                [
                     ft.Text(
-                        "Esperando pedidos...",
-                        color=MUTED,
-                        italic=True,
-                    ),
-                    padding=20,
-                )
-            )
-        for p in sorted(pl, key=lambda x: x["id"]):
-            col_l.controls.append(
-                ft.Container(
-                    bgcolor=ROW_BG,
-                    padding=15,
-                    border_radius=8,
-                    border=ft.border.only(
-                        left=ft.BorderSide(5, GREEN)
+                        f"#{str(p['id']).zfill(3)}",
+                        size=28,
+                        weight="bold",
+                        color=WHITE,
                     ),
-                    content=ft.Row(
+                    ft.Row(
                         [
                             ft.Text(
-                                f"#{str(p['id']).zfill(3)}",
-                                size=28,
+                                "¡LISTO!",
+                                color=GREEN,
                                 weight="bold",
-                                color=WHITE,
+                                size=16,
                             ),
-                            ft.Row(
-                                [
-                                    ft.Text(
-                                        "¡LISTO!",
-                                        color=GREEN,
-                                        weight="bold",
-                                        size=16,
-                                    ),
-                                    ft.Icon(
-                                        "check_circle", color=GREEN
-                                    ),
-                                ],
-                                spacing=5,
+                            ft.Icon(
+                                "check_circle", color=GREEN
                             ),
                         ],
-                        alignment="spaceBetween",
+                        spacing=5,
                     ),
-                )
+                ],
+                alignment="spaceBetween",
+            ),
+        )
+
+    def build_placeholder(texto):
+        return ft.Container(
+            ft.Text(
+                texto,
+                color=MUTED,
+                italic=True,
+            ),
+            padding=20,
+        )
+
+    vacio_p = build_placeholder("Todo tranquilo...")
+    vacio_l = build_placeholder("Esperando pedidos...")
+
+    # Tiles por (id, estado): cuando un pedido pasa de preparando a listo solo
+    # se crea su tile nuevo; el resto del tablero se reutiliza
+    tiles = {}  # (pid, estado) -> (modo, control)
+    ultima_huella = [None]
+
+    async def revelar(nuevos):
+        # Segundo paso del fade-in: el tile ya llegó con opacidad 0
+        await asyncio.sleep(0.05)
+        for t in nuevos:
+            t.opacity = 1
+        page.update()
+
+    @perf.medido("render.pantalla")
+    def render():
+        try:
+            pp = sorted(
+                (p for p in feed.pedidos if p.get("estado") == "preparando"),
+                key=lambda x: x["id"],
             )
+            pl = sorted(
+                (p for p in feed.pedidos if p.get("estado") == "listo"),
+                key=lambda x: x["id"],
+            )
+        except:
+            pp = []
+            pl = []
+
+        # Huella de lo que se ve en pantalla; si no cambió no hay nada que mandar
+        huella = (
+            tuple((p["id"], p.get("modo")) for p in pp),
+            tuple(p["id"] for p in pl),
+        )
+        if huella == ultima_huella[0]:
+            return
+        primera = ultima_huella[0] is None
+        ultima_huella[0] = huella
+
+        vigentes = {}
+        nuevos = []
+
+        def tile(p, estado, build):
+            key = (p["id"], estado)
+            cached = tiles.get(key)
+            if cached and cached[0] == p.get("modo"):
+                ctrl = cached[1]
+            else:
+                ctrl = build(p)
+                if not primera:
+                    # Solo los tiles que se movieron entran con animación
+                    ctrl.opacity = 0
+                    nuevos.append(ctrl)
+            vigentes[key] = (p.get("modo"), ctrl)
+            return ctrl
+
+        col_p.controls = [
+            tile(p, "preparando", build_tile_preparando) for p in pp
+        ] or [vacio_p]
+        col_l.controls = [
+            tile(p, "listo", build_tile_listo) for p in pl
+        ] or [vacio_l]
+        tiles.clear()
+        tiles.update(vigentes)
         page.update()
+        if nuevos:
+            page.run_task(revelar, nuevos)
 
     grid = ft.ResponsiveRow(
         controls=[
@@ -1745,23 +2579,17 @@ def PantallaView(page: ft.Page):
 
     control_flag = [True]
 
-    async def poll():
-        while control_flag[0]:
-            try:
-                async with httpx.AsyncClient(trust_env=False) as client:
-                    r = await client.get(f"{API_URL}/pedidos", timeout=5)
-                    if r.status_code == 200:
-                        state.pedidos = r.json()
-                        render()
-            except Exception as e:
-                print("Error poll pantalla:", e)
-            try:
-                await asyncio.sleep(POLL_SECONDS)
-            except:
-                control_flag[0] = False
-
-    page.run_task(poll)
-    page.views[-1].on_dispose = lambda e: control_flag.__setitem__(0, False)
+    # Dibujamos lo que ya tenemos; después solo se redibuja cuando hay cambios
+    render()
+    tarea_de_vista(
+        page,
+        control_flag,
+        seguir_pedidos,
+        render,
+        control_flag,
+        "pantalla",
+        feed,
+    )
 
 # --- MAIN ---
 def main(page: ft.Page):
@@ -1774,8 +2602,26 @@ def main(page: ft.Page):
 
     # servicio background que sincroniza pedidos offline
     page.run_task(sync_offline_orders, page)
+    # Métricas de render/red (solo con PIKO_PERF=1)
+    montar_perf(page)
+
+    # El cliente HTTP se comparte entre sesiones; al cerrarse la última
+    # liberamos sus conexiones (se vuelve a crear si alguien más entra)
+    global _sesiones_activas
+    _sesiones_activas += 1
+
+    async def on_close(e):
+        global _sesiones_activas
+        detener_vista(page)
+        _sesiones_activas -= 1
+        if _sesiones_activas <= 0:
+            await cerrar_api_client()
+
+    page.on_close = on_close
 
     def route_change(route):
+        # La vista anterior deja de seguir pedidos antes de armar la nueva
+        detener_vista(page)
         page.views.clear()
         if page.route == "/":
             StartView(page)